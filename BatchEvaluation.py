@@ -0,0 +1,185 @@
+# Vectorized ChessBoard.evaluate_position() over many positions at once.
+#
+# Positions are encoded as an (N, 64) int8 array of piece codes, square
+# indices as in Position.matrix (0 is a8), the codes of CompactPosition
+# (ChessyMoon.pieceCodes). Every term of the scalar evaluator (material, piece-square
+# tables, mobility and the king check bonus) is computed with array
+# operations and summed in the same order, so the scores are identical.
+#
+# NumPy is optional: the engine never imports this module, and calling it
+# without NumPy installed raises.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import ChessyMoon
+from ChessyMoon import WHITE, BLACK, EMPTY_CODE as EMPTY, WHITE_CODE as WHITE_FLAG, pieceCodes as CODES, piece_code, CompactPosition
+from BitboardHelper import KNIGHT_VECTORS, KING_VECTORS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS
+
+
+def require_numpy():
+    if np is None:
+        raise Exception("BatchEvaluation needs NumPy (pip install numpy)")
+
+def encode_positions(positions) -> "np.ndarray":
+    """
+    (N, 64) int8 piece codes of ChessyMoon Positions or CompactPositions
+    """
+    require_numpy()
+    codes = np.zeros((len(positions), 64), dtype=np.int8)
+    for row, position in enumerate(positions):
+        if isinstance(position, CompactPosition):
+            codes[row] = np.frombuffer(position.board, dtype=np.int8)
+        else:
+            codes[row] = [piece_code(piece) for piece in position.matrix]
+    return codes
+
+
+def _shift(mask, direction):
+    """
+    `mask` (N, 64) moved one step by `direction` (col, row), squares pushed off the board are lost
+    """
+    dcol, drow = direction
+    board = mask.reshape(-1, 8, 8)
+    shifted = np.zeros_like(board)
+    shifted[:, max(drow, 0):8 + min(drow, 0), max(dcol, 0):8 + min(dcol, 0)] = \
+        board[:, max(-drow, 0):8 + min(-drow, 0), max(-dcol, 0):8 + min(-dcol, 0)]
+    return shifted.reshape(-1, 64)
+
+def _step(pieces, vectors, free, tally):
+    """
+    Adds to `tally` the squares of `free` one step away from `pieces`, returns every square reached
+    """
+    reached = np.zeros_like(pieces)
+    for vector in vectors:
+        heads = _shift(pieces, vector)
+        tally += heads & free
+        reached |= heads
+    return reached
+
+def _slide(sliders, directions, empty, free, tally):
+    """
+    Adds to `tally` the squares of `free` the `sliders` reach along
+    `directions`, stopping on the first occupied square, returns every
+    square reached
+    """
+    reached = np.zeros_like(sliders)
+    for direction in directions:
+        heads = sliders
+        for _distance in range(7):
+            heads = _shift(heads, direction)
+            tally += heads & free
+            reached |= heads
+            heads = heads & empty
+            if not heads.any():
+                break
+    return reached
+
+
+def _material_tables():
+    material = np.zeros(16, dtype=np.float64)
+    pst = np.zeros((16, 64), dtype=np.float64)
+    for piece, code in CODES.items():
+        for color in (BLACK, WHITE):
+            flagged = code | (WHITE_FLAG if color else 0)
+            material[flagged] = ChessyMoon.pieceWeights[piece]
+            pst[flagged] = ChessyMoon.pieceSquareTables[color][piece]
+    return material, pst
+
+def _mobility(codes, color, empty, occupied):
+    flag = WHITE_FLAG if color else 0
+    own = occupied & ((codes & WHITE_FLAG) == flag)
+    enemy = occupied & ~own
+    free = ~own
+
+    def pieces(*kinds):
+        mask = np.zeros(codes.shape, dtype=bool)
+        for kind in kinds:
+            mask |= codes == (CODES[kind] | flag)
+        return mask
+
+    # moves per target square, summed once at the end
+    tally = np.zeros(codes.shape, dtype=np.uint8)
+
+    pawns = pieces('p')
+    forward = -1 if color else 1
+    tally += _shift(pawns, (0, forward)) & empty
+    _step(pawns, [(-1, forward), (1, forward)], enemy, tally)
+
+    _step(pieces('n', 'ñ'), KNIGHT_VECTORS, free, tally)
+    _step(pieces('k'), KING_VECTORS, free, tally)
+    _slide(pieces('b', 'q'), BISHOP_DIRECTIONS, empty, free, tally)
+    _slide(pieces('r', 'q', 'ñ'), ROOK_DIRECTIONS, empty, free, tally)
+    return tally.sum(axis=1, dtype=np.int64)
+
+def _check_bonus(codes, color, empty):
+    """
+    150 for each position where `color`'s king is attacked by a pawn, knight,
+    bishop, rook or queen (the attackers evaluate_position counts), -150
+    where the king is gone, else 0
+    """
+    flag = WHITE_FLAG if color else 0
+    enemy = 0 if color else WHITE_FLAG
+    king = codes == (CODES['k'] | flag)
+
+    def enemies(*kinds):
+        mask = np.zeros(codes.shape, dtype=bool)
+        for kind in kinds:
+            mask |= codes == (CODES[kind] | enemy)
+        return mask
+
+    # walk out from the king: whatever it reaches as a piece also reaches it
+    unused = np.zeros(codes.shape, dtype=np.uint8)
+    diagonal = _slide(king, BISHOP_DIRECTIONS, empty, empty, unused)
+    straight = _slide(king, ROOK_DIRECTIONS, empty, empty, unused)
+    knight = _step(king, KNIGHT_VECTORS, empty, unused)
+    forward = -1 if color else 1
+    pawn = _step(king, [(-1, forward), (1, forward)], empty, unused)
+
+    attacked = ((diagonal & enemies('b', 'q')) | (straight & enemies('r', 'q'))
+                | (knight & enemies('n')) | (pawn & enemies('p'))).any(axis=1)
+    return np.where(king.any(axis=1), np.where(attacked, 150.0, 0.0), -150.0)
+
+def evaluate_batch(codes) -> "np.ndarray":
+    """
+    White's point of view scores of (N, 64) piece codes, equal to
+    ChessBoard.evaluate_position() on the same positions
+    """
+    require_numpy()
+    codes = np.asarray(codes, dtype=np.int8)
+    materialTable, pstTable = _material_tables()
+
+    occupied = codes != EMPTY
+    empty = ~occupied
+    white = occupied & ((codes & WHITE_FLAG) != 0)
+    black = occupied & ~white
+
+    values = materialTable[codes]
+    materialScore = (values * white).sum(axis=1) - (values * black).sum(axis=1)
+
+    squarePoints = pstTable.reshape(-1)[codes.astype(np.int64) * 64 + np.arange(64)]
+    positionScore = ChessyMoon.positionTableWeightFactor * ((squarePoints * white).sum(axis=1) - (squarePoints * black).sum(axis=1))
+
+    mobilityScore = ChessyMoon.mobilityWt * (_mobility(codes, WHITE, empty, occupied) - _mobility(codes, BLACK, empty, occupied))
+
+    checkingKingScore = _check_bonus(codes, WHITE, empty) - _check_bonus(codes, BLACK, empty)
+
+    return materialScore + mobilityScore + positionScore + checkingKingScore
+
+def evaluate_children(board) -> list[tuple[tuple, float]]:
+    """
+    (move, white's point of view score) of every move of the side to move,
+    evaluated in one batch
+    """
+    require_numpy()
+    moves = board.get_possible_moves()
+    children = []
+    for squareFrom, squareTo in moves:
+        board.make_move(squareFrom, squareTo)
+        children.append([piece_code(piece) for piece in board.position.matrix])
+        board.unmake_move()
+    if not children:
+        return []
+    return list(zip(moves, evaluate_batch(np.array(children, dtype=np.int8)).tolist()))
@@ -0,0 +1,123 @@
+# Bitboard tables for the move generator.
+#
+# Bit `idx` of a bitboard is the square `idx` of Position.matrix, so bit 0 is
+# a8 and bit 63 is h1 (row 0 is the 8th rank, white pawns move towards it).
+
+FULL = (1 << 64) - 1
+
+FILE_A = sum(1 << (8 * row) for row in range(8))
+FILE_H = FILE_A << 7
+
+WHITE = 1
+BLACK = 0
+
+# (col, row) steps. Directions that increase the square index come first, the
+# nearest blocker on those rays is the lowest set bit, on the others the highest.
+POSITIVE_DIRECTIONS = [( 1, 0), ( 0, 1), ( 1, 1), (-1, 1)]
+NEGATIVE_DIRECTIONS = [(-1, 0), ( 0,-1), (-1,-1), ( 1,-1)]
+
+ROOK_DIRECTIONS   = [( 1, 0), ( 0, 1), (-1, 0), ( 0,-1)]
+BISHOP_DIRECTIONS = [( 1, 1), (-1, 1), (-1,-1), ( 1,-1)]
+
+KNIGHT_VECTORS = [( 1, 2), (-1, 2), ( 1,-2), (-1,-2), ( 2, 1), (-2, 1), ( 2,-1), (-2,-1)]
+KING_VECTORS   = [(-1,-1), (-1, 1), (-1, 0), ( 0,-1), ( 0, 1), ( 1,-1), ( 1, 1), ( 1, 0)]
+
+
+def _on_board(col, row):
+    return 0 <= col < 8 and 0 <= row < 8
+
+def _vector_table(vectors):
+    table = []
+    for idx in range(64):
+        row, col = divmod(idx, 8)
+        bb = 0
+        for dcol, drow in vectors:
+            if _on_board(col + dcol, row + drow):
+                bb |= 1 << (8 * (row + drow) + col + dcol)
+        table.append(bb)
+    return table
+
+def _ray_table(direction):
+    dcol, drow = direction
+    table = []
+    for idx in range(64):
+        row, col = divmod(idx, 8)
+        bb = 0
+        col, row = col + dcol, row + drow
+        while _on_board(col, row):
+            bb |= 1 << (8 * row + col)
+            col, row = col + dcol, row + drow
+        table.append(bb)
+    return table
+
+KNIGHT_ATTACKS = _vector_table(KNIGHT_VECTORS)
+KING_ATTACKS   = _vector_table(KING_VECTORS)
+
+# indexed by color, then square
+PAWN_ATTACKS = [_vector_table([( 1, 1), (-1, 1)]), _vector_table([(-1,-1), ( 1,-1)])]
+PAWN_PUSHES  = [_vector_table([( 0, 1)]),          _vector_table([( 0,-1)])]
+
+RAYS = {direction: _ray_table(direction) for direction in POSITIVE_DIRECTIONS + NEGATIVE_DIRECTIONS}
+
+def _relevant_mask(idx, directions):
+    # the last square of a ray never changes the attack set, leave it out of the key
+    mask = 0
+    for direction in directions:
+        ray = RAYS[direction][idx]
+        if direction in POSITIVE_DIRECTIONS:
+            ray &= ~(1 << (ray.bit_length() - 1)) if ray else 0
+        else:
+            ray &= ray - 1
+        mask |= ray
+    return mask
+
+ROOK_MASKS   = [_relevant_mask(idx, ROOK_DIRECTIONS)   for idx in range(64)]
+BISHOP_MASKS = [_relevant_mask(idx, BISHOP_DIRECTIONS) for idx in range(64)]
+
+# Per-square attack sets memoized by relevant occupancy. Each square holds at
+# most 4096 (rook) or 512 (bishop) entries, filled on first use.
+_rook_memo   = [{} for _ in range(64)]
+_bishop_memo = [{} for _ in range(64)]
+
+
+def sliding_attacks(idx:int, occupancy:int, directions) -> int:
+    attacks = 0
+    for direction in directions:
+        rays = RAYS[direction]
+        ray = rays[idx]
+        blockers = ray & occupancy
+        if blockers:
+            if direction in POSITIVE_DIRECTIONS:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= rays[blocker]
+        attacks |= ray
+    return attacks
+
+def rook_attacks(idx:int, occupancy:int) -> int:
+    key = occupancy & ROOK_MASKS[idx]
+    memo = _rook_memo[idx]
+    attacks = memo.get(key)
+    if attacks is None:
+        attacks = memo[key] = sliding_attacks(idx, key, ROOK_DIRECTIONS)
+    return attacks
+
+def bishop_attacks(idx:int, occupancy:int) -> int:
+    key = occupancy & BISHOP_MASKS[idx]
+    memo = _bishop_memo[idx]
+    attacks = memo.get(key)
+    if attacks is None:
+        attacks = memo[key] = sliding_attacks(idx, key, BISHOP_DIRECTIONS)
+    return attacks
+
+def queen_attacks(idx:int, occupancy:int) -> int:
+    return rook_attacks(idx, occupancy) | bishop_attacks(idx, occupancy)
+
+def squares_of(bitboard:int) -> list[int]:
+    squares = []
+    while bitboard:
+        low = bitboard & -bitboard
+        squares.append(low.bit_length() - 1)
+        bitboard ^= low
+    return squares
@@ -1,12 +1,29 @@
+import atexit
+import bisect
 import json
 import math
+import mmap
+import multiprocessing
+import os
+import queue
 import random
+import struct
+import tempfile
 import time
+from array import array
+from multiprocessing import shared_memory
 
 from StaticAnalysisHelper import PositionTableWeights
+from BitboardHelper import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, PAWN_PUSHES, FULL, FILE_A, FILE_H
+from BitboardHelper import rook_attacks, bishop_attacks, squares_of
+from BitboardHelper import ROOK_DIRECTIONS, BISHOP_DIRECTIONS, KNIGHT_VECTORS, KING_VECTORS
 
 DEBUG = True
 
+# recompute material and piece-square scores from scratch at every
+# evaluation and fail if the incremental totals disagree
+CHECK_INCREMENTAL_EVAL = False
+
 WHITE = 1
 BLACK = 0
 
@@ -23,6 +40,37 @@ pawnWt = 100
 knookWt = 650
 
 nodes = 0
+quiescenceNodes = 0
+pvsResearches = 0
+aspirationResearches = 0
+
+hashSizeMb = 16
+
+# fill a SearchStats for every search (ResultDebug.stats), off costs one test per node
+collectSearchStats = False
+
+# worker processes for Lazy SMP, 1 searches in this process
+searchThreads = 1
+# seconds stopped Lazy SMP workers get to report before they are terminated
+workerStopGrace = 1.0
+
+maxSearchDepth = 64
+
+# quiescence search bounds: plies of captures past the horizon, nodes per
+# horizon node, and the margin under which a capture cannot raise alpha
+maxQuiescenceDepth = 8
+maxQuiescenceNodes = 1000
+deltaMargin = 200
+
+# principal variation search: scores are multiples of 0.1, a null window
+# narrower than that cannot contain any score
+nullWindowWidth = 0.01
+aspirationWindow = 50
+
+# transposition table bound types
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
 
 positionTableWeightFactor = 0.8
 
@@ -38,6 +86,48 @@ piece_point_chart = {
     'ñ': 6.5,
 }
 
+piece_types = ['p', 'n', 'b', 'r', 'q', 'k', 'ñ']
+
+# compact piece codes (CompactPosition, BatchEvaluation): index in
+# piece_types plus one, with WHITE_CODE added for white; 0 is an empty square
+EMPTY_CODE = 0
+WHITE_CODE = 8
+pieceCodes = {piece: idx + 1 for idx, piece in enumerate(piece_types)}
+
+# Packed moves: from | to << 6 | flags, which fits the 16-bit move field of
+# the transposition table. Move lists are array('I') buffers of them and
+# notation is only rendered for output (see Move).
+MOVE_SQUARES   = 0xFFF
+MOVE_CAPTURE   = 1 << 12
+MOVE_PROMOTION = 1 << 13
+MOVE_FUSION    = 1 << 14   # a knight onto its own rook, never generated
+MOVE_PAWN_JUMP = 1 << 15   # double push, never generated (books and user input)
+
+pieceWeights = {
+    'k': kingWt,
+    'q': queenWt,
+    'r': rookWt,
+    'n': knightWt,
+    'b': bishopWt,
+    'p': pawnWt,
+    'ñ': knookWt,
+}
+
+# piece-square tables indexed [color][piece][square], black reads them mirrored
+pieceSquareTables = [
+    {piece: [PositionTableWeights[piece][63-idx] for idx in range(64)] for piece in piece_types},
+    {piece: list(PositionTableWeights[piece]) for piece in piece_types},
+]
+
+# Zobrist keys, indexed [color][piece][square]. Seeded so hashes are stable
+# across processes and can be stored (opening books, shared tables).
+_zobristRandom = random.Random(0x43484553)
+zobristPieceKeys = [
+    {piece: [_zobristRandom.getrandbits(64) for _ in range(64)] for piece in piece_types}
+    for _color in (BLACK, WHITE)
+]
+zobristTurnKey = _zobristRandom.getrandbits(64)  # xored in when black is to move
+
 
 class ResultDebug:
     def __init__(self, debugParams=None):
@@ -50,6 +140,21 @@ class OpeningBook:
         self.src = src
         with open(src, 'r') as file: 
             self.variations = json.loads(file.read())
+        self.hashed = None
+
+    def get_moves(self, position) -> list[str] | None:
+        # built on first probe: the book is keyed by FEN, search by Zobrist hash
+        if self.hashed is None:
+            self.hashed = {fen_hash(fen): moves for fen, moves in self.variations.items()}
+        return self.hashed.get(position.hash)
+
+    def get_entries(self, position) -> list[tuple[int, int]]:
+        moves = self.get_moves(position) or []
+        entries = []
+        for move in moves:
+            squareFrom, squareTo = move.split(' ')
+            entries.append((Square(algebraic=squareFrom).idx | (Square(algebraic=squareTo).idx << 6), 1))
+        return entries
 
     def count_variation(self, tree, c=0):
         for key in tree:
@@ -60,6 +165,138 @@ class OpeningBook:
                 c += 1
         return c
 
+def fen_hash(fen:str) -> int:
+    """
+    Zobrist hash of a FEN, same value as Position(fen).hash without building the Position
+    """
+    key = 0
+    idx = 0
+    placement, _, rest = fen.partition(' ')
+    for char in placement:
+        if char == '/':
+            continue
+        if char.isnumeric():
+            idx += int(char)
+            continue
+        key ^= zobristPieceKeys[char.isupper()][char.lower()][idx]
+        idx += 1
+    if rest.startswith('b'):
+        key ^= zobristTurnKey
+    return key
+
+class CompiledOpeningBook:
+    """
+    Read-only book compiled by write_compiled_book(): a header, the sorted
+    64-bit position hashes, then one packed entry (move | weight << 16) per
+    hash, with moves packed as from | to << 6. The file is memory mapped
+    and probed by bisection, so opening it costs no parsing.
+    """
+    MAGIC = b'CMBOOK01'
+    HEADER = struct.Struct('<8sQ')
+
+    def __init__(self, src="./opening_book.bin") -> None:
+        self.src = src
+        with open(src, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buffer) < self.HEADER.size:
+            raise ValueError(f"{src} is not a compiled opening book")
+        magic, count = self.HEADER.unpack_from(self.buffer)
+        if magic != self.MAGIC:
+            raise ValueError(f"{src} is not a compiled opening book")
+        if len(self.buffer) < self.HEADER.size + 12 * count:
+            raise ValueError(f"{src} is truncated ({len(self.buffer)} bytes for {count} entries)")
+        view = memoryview(self.buffer)
+        start = self.HEADER.size
+        self.count = count
+        self.hashes = view[start:start + 8 * count].cast('Q')
+        self.entries = view[start + 8 * count:start + 12 * count].cast('I')
+
+    def get_entries(self, position) -> list[tuple[int, int]]:
+        """
+        (move, weight) pairs stored for the position
+        """
+        key = position.hash
+        hashes, entries = self.hashes, self.entries
+        idx = bisect.bisect_left(hashes, key)
+        found = []
+        while idx < self.count and hashes[idx] == key:
+            entry = entries[idx]
+            found.append((entry & 0xFFFF, entry >> 16))
+            idx += 1
+        return found
+
+    def get_moves(self, position) -> list[str] | None:
+        entries = self.get_entries(position)
+        if not entries:
+            return None
+        return [f"{boardSquares[move & 63]} {boardSquares[move >> 6]}" for move, _weight in entries]
+
+class NoOpeningBook:
+    """
+    Stands in for the opening book when every position should be searched
+    """
+    def get_entries(self, position) -> list[tuple[int, int]]:
+        return []
+
+    def get_moves(self, position):
+        return None
+
+def write_compiled_book(entries:dict[int, dict[int, int]], dst:str):
+    """
+    Writes {hash: {move: weight}} in the CompiledOpeningBook format
+    """
+    rows = sorted((key, move, min(weight, 0xFFFF)) for key, moves in entries.items() for move, weight in moves.items())
+    # a temporary file of its own: several engine processes may compile the same book at once
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst) or '.', prefix=os.path.basename(dst) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(CompiledOpeningBook.HEADER.pack(CompiledOpeningBook.MAGIC, len(rows)))
+            file.write(struct.pack(f'<{len(rows)}Q', *[key for key, _move, _weight in rows]))
+            file.write(struct.pack(f'<{len(rows)}I', *[move | (weight << 16) for _key, move, weight in rows]))
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def compile_opening_book(src="./opening_book.json", dst="./opening_book.bin"):
+    entries = {}
+    for fen, moves in OpeningBook(src).variations.items():
+        weights = entries.setdefault(fen_hash(fen), {})
+        for move in moves:
+            squareFrom, squareTo = move.split(' ')
+            packed = Square(algebraic=squareFrom).idx | (Square(algebraic=squareTo).idx << 6)
+            weights[packed] = weights.get(packed, 0) + 1
+    write_compiled_book(entries, dst)
+
+def get_opening_book(src="./opening_book.json"):
+    """
+    The process-wide book, loaded on first use. The JSON book is compiled
+    next to itself the first time (and again whenever the JSON changes),
+    later processes only map the compiled file. A .bin `src` (e.g. one
+    written by OpeningBookBuilder) is mapped as is.
+    """
+    global openingBook
+    if openingBook is not None:
+        return openingBook
+
+    if src.endswith('.bin'):
+        openingBook = CompiledOpeningBook(src)
+        return openingBook
+
+    compiled = os.path.splitext(src)[0] + '.bin'
+    try:
+        if not os.path.exists(compiled) or os.path.getmtime(compiled) < os.path.getmtime(src):
+            compile_opening_book(src, compiled)
+    except OSError:
+        pass
+
+    try:
+        openingBook = CompiledOpeningBook(compiled)
+    except (OSError, ValueError):
+        openingBook = OpeningBook(src)
+    return openingBook
+
 class Piece:
     def __init__(self, pieceNotation:str=None) -> None:
         if pieceNotation:
@@ -82,35 +319,100 @@ class Piece:
     def points(self):
         return piece_point_chart[self.piece]
 
+# Pieces are never mutated once placed, so every square holding the same
+# piece shares one object, indexed by piece code
+codePieces = [None] * 16
+for _piece, _code in pieceCodes.items():
+    codePieces[_code] = Piece(_piece)
+    codePieces[_code | WHITE_CODE] = Piece(_piece.upper())
+
+queens = [codePieces[pieceCodes['q']], codePieces[pieceCodes['q'] | WHITE_CODE]]
+knooks = [codePieces[pieceCodes['ñ']], codePieces[pieceCodes['ñ'] | WHITE_CODE]]
+
+def piece_code(piece:Piece) -> int:
+    if not piece:
+        return EMPTY_CODE
+    return pieceCodes[piece.piece] | (WHITE_CODE if piece.color else 0)
+
+def fen_code(char:str) -> int:
+    return pieceCodes[char.lower()] | (WHITE_CODE if char.isupper() else 0)
+
 class Square:
+    """
+    One of the 64 squares. Squares are interned and immutable: Square(...)
+    returns the shared instance from boardSquares, which carries its
+    coordinates, name and the squares around it, precomputed.
+    """
+    __slots__ = ('idx', 'row', 'col', 'bit', 'algebraic_str', 'diagonals', 'lines', 'neighbors', 'knight_jumps', 'pawn_attacks')
+
     def __str__(self) -> str:
-        return self.algebraic()
+        return self.algebraic_str
 
     def __repr__(self) -> str:
-        return self.algebraic()
+        return self.algebraic_str
 
-    def __init__(self, idx:int=None, col:int=None, row:int=None, algebraic:str=None) -> None:
-        if not (idx is None):
-            self.idx = idx
-            self.row = idx // 8
-            self.col = idx %  8
+    def __new__(cls, idx:int=None, col:int=None, row:int=None, algebraic:str=None):
+        if idx is None:
+            if algebraic:
+                if len(algebraic) != 2 or not algebraic[1].isdigit():
+                    raise Exception(f"Invalid square {algebraic!r}")
+                row = 7 - (int(algebraic[1]) - 1)
+                col = ord(algebraic[0].lower()) - 97
+            if not (0 <= col < 8 and 0 <= row < 8):
+                raise Exception(f"Invalid square (col {col}, row {row})")
+            idx = (8 * (row)) + col
+        elif not 0 <= idx < 64:
+            raise Exception(f"Invalid square index {idx}")
+        return boardSquares[idx]
 
-        elif algebraic:
-            self.algebraic_str = algebraic.lower()
-            self.row = 7 - (int(algebraic[1]) - 1)
-            self.col = ord(algebraic[0]) - 97
-            self.idx = (8 * (self.row)) + self.col
+    def __setattr__(self, name, value):
+        raise AttributeError("Squares are shared and cannot be changed")
 
-        else:
-            self.col = col
-            self.row = row
-            self.idx = (8 * (row)) + col
+    def __reduce__(self):
+        return (Square, (self.idx,))
 
     def algebraic(self):
-        if not hasattr(self,"algebraic_str"):
-            self.algebraic_str = chr(self.col + 97) + str(8 - self.row)
         return self.algebraic_str
 
+def _build_squares() -> list[Square]:
+    squares = [object.__new__(Square) for _idx in range(64)]
+
+    def walk(idx, vectors, steps):
+        # squares reached from `idx` along each vector, nearest first
+        row, col = divmod(idx, 8)
+        walks = []
+        for dcol, drow in vectors:
+            line = []
+            for step in range(1, steps + 1):
+                c, r = col + step * dcol, row + step * drow
+                if not (0 <= c < 8 and 0 <= r < 8):
+                    break
+                line.append(squares[8 * r + c])
+            walks.append(tuple(line))
+        return walks
+
+    for idx, square in enumerate(squares):
+        row, col = divmod(idx, 8)
+        fields = {
+            'idx': idx,
+            'row': row,
+            'col': col,
+            'bit': 1 << idx,
+            'algebraic_str': chr(col + 97) + str(8 - row),
+            'diagonals': tuple(walk(idx, BISHOP_DIRECTIONS, 7)),
+            'lines': tuple(walk(idx, ROOK_DIRECTIONS, 7)),
+            'neighbors': tuple(s for line in walk(idx, KING_VECTORS, 1) for s in line),
+            'knight_jumps': tuple(s for line in walk(idx, KNIGHT_VECTORS, 1) for s in line),
+            # squares from which an enemy pawn attacks a piece of [color] here
+            'pawn_attacks': tuple(tuple(squares[target] for target in squares_of(PAWN_ATTACKS[color][idx])) for color in (BLACK, WHITE)),
+        }
+        for name, value in fields.items():
+            object.__setattr__(square, name, value)
+    return squares
+
+# the 64 Square singletons, by index (0 is a8)
+boardSquares = _build_squares()
+
 class Squares:
     def __init__(self,  idx=None, col=None, row=None, algebraic=None) -> None:
         squares = []
@@ -133,24 +435,254 @@ class Position:
         self.fen = fen
         self.fen_calc = None
         self.turn  : bool   = WHITE
-        self.w_king: Square = Square(idx=0)
-        self.b_king: Square = Square(idx=0)
+        self.w_king: Square = boardSquares[0]
+        self.b_king: Square = boardSquares[0]
         if not matrix:
             self.matrix = self.fenLoader()
         else:
             self.matrix = matrix
+        self.load_pieces()
+        self.hash = self.compute_hash()
 
     def deep_copy(self):
-        position = Position(matrix=self.matrix.copy())
+        position = Position.__new__(Position)
+        position.matrix = self.matrix.copy()
 
         position.fen = self.fen
         position.fen_calc = self.fen_calc
         position.turn = self.turn
         position.w_king = self.w_king
         position.b_king = self.b_king
+        position.bitboards = [self.bitboards[BLACK].copy(), self.bitboards[WHITE].copy()]
+        position.occupancy = self.occupancy.copy()
+        position.material = self.material.copy()
+        position.pst = self.pst.copy()
+        position.hash = self.hash
 
         return position
 
+    def load_pieces(self):
+        # one bitboard per piece type and color, indexed [color][piece]: the
+        # square sets of each kind of piece, kept up to date by put_piece and
+        # remove_piece, so nothing past loading needs to scan the 64 squares
+        self.bitboards = [dict.fromkeys(piece_types, 0), dict.fromkeys(piece_types, 0)]
+        self.occupancy = [0, 0]
+        # running material and piece-square totals, indexed by color
+        self.material = [0, 0]
+        self.pst = [0, 0]
+        for idx, piece in enumerate(self.matrix):
+            if piece:
+                self.bitboards[piece.color][piece.piece] |= 1 << idx
+                self.occupancy[piece.color] |= 1 << idx
+                self.material[piece.color] += pieceWeights[piece.piece]
+                self.pst[piece.color] += pieceSquareTables[piece.color][piece.piece][idx]
+
+    def compute_hash(self) -> int:
+        key = 0 if self.turn else zobristTurnKey
+        for idx, piece in enumerate(self.matrix):
+            if piece:
+                key ^= zobristPieceKeys[piece.color][piece.piece][idx]
+        return key
+
+    def remove_piece(self, idx:int):
+        piece = self.matrix[idx]
+        if piece:
+            color, kind = piece.color, piece.piece
+            mask = FULL ^ (1 << idx)
+            self.bitboards[color][kind] &= mask
+            self.occupancy[color] &= mask
+            self.material[color] -= pieceWeights[kind]
+            self.pst[color] -= pieceSquareTables[color][kind][idx]
+            self.hash ^= zobristPieceKeys[color][kind][idx]
+            self.matrix[idx] = None
+        return piece
+
+    def put_piece(self, idx:int, piece:Piece):
+        color, kind = piece.color, piece.piece
+        bit = 1 << idx
+        self.bitboards[color][kind] |= bit
+        self.occupancy[color] |= bit
+        self.material[color] += pieceWeights[kind]
+        self.pst[color] += pieceSquareTables[color][kind][idx]
+        self.hash ^= zobristPieceKeys[color][kind][idx]
+        self.matrix[idx] = piece
+
+    def make_move(self, src:int, dst:int):
+        """
+        Plays src -> dst in place and returns the record unmake_move needs to restore it
+        """
+        matrix = self.matrix
+        piece = matrix[src]
+        captured = matrix[dst]
+
+        undo = (src, dst, piece, captured, self.w_king, self.b_king, self.turn, self.fen_calc)
+
+        self.remove_piece(src)
+        placed = piece
+
+        if captured:
+            self.remove_piece(dst)
+            if captured.color == piece.color:
+                # Knook-lear fusion: a knight landing on its own rook
+                placed = knooks[piece.color]
+            elif captured.piece == 'k':
+                if captured.color == WHITE:
+                    self.w_king = None
+                else:
+                    self.b_king = None
+
+        kind = piece.piece
+        if kind == 'p':
+            if (piece.color and dst < 8) or (not piece.color and dst >= 56):
+                placed = queens[piece.color]
+        elif kind == 'k':
+            if piece.color == WHITE:
+                self.w_king = boardSquares[dst]
+            else:
+                self.b_king = boardSquares[dst]
+
+        self.put_piece(dst, placed)
+
+        self.turn = not self.turn
+        self.hash ^= zobristTurnKey
+        self.fen_calc = None
+
+        return undo
+
+    def unmake_move(self, undo):
+        src, dst, piece, captured, w_king, b_king, turn, fen_calc = undo
+
+        self.remove_piece(dst)
+        self.put_piece(src, piece)
+        if captured:
+            self.put_piece(dst, captured)
+
+        self.w_king = w_king
+        self.b_king = b_king
+        self.turn = turn
+        self.hash ^= zobristTurnKey
+        self.fen_calc = fen_calc
+
+    def targets(self, idx:int) -> int:
+        """
+        Bitboard of the squares the piece on `idx` can move to
+        """
+        piece = self.matrix[idx]
+        color = piece.color
+        occupancy = self.occupancy
+        own = occupancy[color]
+        everything = own | occupancy[not color]
+        kind = piece.piece
+
+        if kind == 'p':
+            return (PAWN_ATTACKS[color][idx] & occupancy[not color]) | (PAWN_PUSHES[color][idx] & ~everything)
+        if kind == 'n':
+            return KNIGHT_ATTACKS[idx] & ~own
+        if kind == 'b':
+            return bishop_attacks(idx, everything) & ~own
+        if kind == 'r':
+            return rook_attacks(idx, everything) & ~own
+        if kind == 'q':
+            return (rook_attacks(idx, everything) | bishop_attacks(idx, everything)) & ~own
+        if kind == 'k':
+            return KING_ATTACKS[idx] & ~own
+        if kind == 'ñ':
+            return (KNIGHT_ATTACKS[idx] | rook_attacks(idx, everything)) & ~own
+        return 0
+
+    def generate_moves(self, color:bool, captures:bool=False) -> array:
+        """
+        Packed moves of `color`, only the captures if `captures`
+        """
+        moves = array('I')
+        append = moves.append
+        matrix = self.matrix
+        enemy = self.occupancy[not color]
+        targets = self.targets
+
+        pieces = self.occupancy[color]
+        while pieces:
+            low = pieces & -pieces
+            pieces ^= low
+            src = low.bit_length() - 1
+
+            reached = targets(src)
+            if captures:
+                reached &= enemy
+            promotes = matrix[src].piece == 'p'
+            while reached:
+                low = reached & -reached
+                reached ^= low
+                dst = low.bit_length() - 1
+                move = src | dst << 6
+                if low & enemy:
+                    move |= MOVE_CAPTURE
+                if promotes and (dst < 8 or dst >= 56):
+                    move |= MOVE_PROMOTION
+                append(move)
+        return moves
+
+    def attackers(self, idx:int, color:bool) -> int:
+        """
+        Bitboard of the pieces of `color` attacking square `idx`
+        """
+        pieces = self.bitboards[color]
+        everything = self.occupancy[BLACK] | self.occupancy[WHITE]
+        attackers = (PAWN_ATTACKS[not color][idx] & pieces['p']) | (KNIGHT_ATTACKS[idx] & (pieces['n'] | pieces['ñ'])) | (KING_ATTACKS[idx] & pieces['k'])
+        diagonal = pieces['b'] | pieces['q']
+        if diagonal:
+            attackers |= bishop_attacks(idx, everything) & diagonal
+        straight = pieces['r'] | pieces['q'] | pieces['ñ']
+        if straight:
+            attackers |= rook_attacks(idx, everything) & straight
+        return attackers
+
+    def is_attacked(self, idx:int, color:bool) -> bool:
+        return bool(self.attackers(idx, color))
+
+    def mobility(self, color:bool) -> int:
+        """
+        Number of moves get_possible_moves(color) would return, counted on bitboards
+        """
+        occupancy = self.occupancy
+        own = occupancy[color]
+        enemy = occupancy[not color]
+        everything = own | enemy
+        empty = FULL ^ everything
+        free = FULL ^ own
+        pieces = self.bitboards[color]
+
+        pawns = pieces['p']
+        if color:
+            count = ((pawns >> 8) & empty).bit_count()
+            count += (((pawns & ~FILE_A) >> 9) & enemy).bit_count()
+            count += (((pawns & ~FILE_H) >> 7) & enemy).bit_count()
+        else:
+            count = ((pawns << 8) & empty).bit_count()
+            count += (((pawns & ~FILE_H) << 9) & enemy).bit_count()
+            count += (((pawns & ~FILE_A) << 7) & enemy).bit_count()
+
+        # only the kinds still on the board are visited
+        if pieces['n']:
+            for idx in squares_of(pieces['n']):
+                count += (KNIGHT_ATTACKS[idx] & free).bit_count()
+        if pieces['k']:
+            for idx in squares_of(pieces['k']):
+                count += (KING_ATTACKS[idx] & free).bit_count()
+        if pieces['b']:
+            for idx in squares_of(pieces['b']):
+                count += (bishop_attacks(idx, everything) & free).bit_count()
+        if pieces['r']:
+            for idx in squares_of(pieces['r']):
+                count += (rook_attacks(idx, everything) & free).bit_count()
+        if pieces['q']:
+            for idx in squares_of(pieces['q']):
+                count += ((rook_attacks(idx, everything) | bishop_attacks(idx, everything)) & free).bit_count()
+        if pieces['ñ']:
+            for idx in squares_of(pieces['ñ']):
+                count += ((KNIGHT_ATTACKS[idx] | rook_attacks(idx, everything)) & free).bit_count()
+        return count
+
     def get_fen(self, simplify=False):
         turn = self.turn
         if not self.fen_calc:
@@ -202,19 +734,12 @@ class Position:
             visual += "\n"
         return visual
     
-    def get_pieces_by_color(self, color:bool):
-        matrix = self.matrix
-        squares: list[Square] = []
-        this = self
-
-        for idx in range (0,63):
-            if matrix[idx]:
-                if matrix[idx].color == color:
-                    square = Square(idx=idx)
-                    rays = Rays(this,square).squares
-                    if rays:
-                        squares.append(square)
-        return squares
+    def get_pieces_by_color(self, color:bool) -> list[Square]:
+        """
+        Squares of the pieces of `color` that have at least one move
+        """
+        targets = self.targets
+        return [boardSquares[idx] for idx in squares_of(self.occupancy[color]) if targets(idx)]
 
 
     def fenLoader(self) -> list[Piece]:
@@ -237,54 +762,210 @@ class Position:
                 continue
             if char.lower() == 'k':
                 if char.isupper():
-                    self.w_king = Square(idx=idx)
+                    self.w_king = boardSquares[idx]
                 else:
-                    self.b_king = Square(idx=idx)
-            position[idx] = Piece(char)
+                    self.b_king = boardSquares[idx]
+            position[idx] = codePieces[fen_code(char)]
             idx += 1
         return position
     
-class Move:
-    def __init__(self, position:Position, squares:tuple[Square, Square], move_type="none") -> str:
-        self.src = squares[0]
-        self.dst = squares[1]
-        self.move_type = move_type
-
-        self.notation = self.render_notation(position.matrix[self.src.idx])
-
-    def render_notation(self, piece:Piece) -> str:
-        functions = {
-            "pawn_move": (self.pawn_notation, "move"),
-            "pawn_capture": (self.pawn_notation, "capture"),
-            "knight_move": (self.knight_notation, "move"),
-            "knight_capture": (self.knight_notation, "capture"),
-            "bishop_move": (self.bishop_notation, "move"),
-            "bishop_capture": (self.bishop_notation, "capture"),
-            "rook_move": (self.rook_notation, "move"),
-            "rook_capture": (self.rook_notation, "capture"),
-            "queen_move": (self.queen_notation, "move"),
-            "queen_capture": (self.queen_notation, "capture"),
-            "king_move": (self.king_notation, "move"),
-            "king_capture": (self.king_notation, "capture"),
-            
-            "knooklear_fusion": (self.knooklear_notation, "fusion"),
-            "knooklear_move": (self.knooklear_notation, "move"),
-            "knooklear_capture": (self.knooklear_notation, "capture"),
-        }
+class CompactPosition:
+    """
+    A position packed for storage: the 64 squares as piece codes in one
+    bytearray (see pieceCodes), the side to move, the king squares (indices,
+    None once captured) and the Zobrist hash. Copying it is one buffer copy.
+    Searching still needs the full Position, see to_position().
+    """
+    __slots__ = ('board', 'turn', 'w_king', 'b_king', 'hash')
+
+    def __init__(self, board:bytes=None, turn:bool=WHITE, hash:int=None) -> None:
+        self.board = bytearray(board) if board is not None else bytearray(64)
+        self.turn = turn
+        self.find_kings()
+        self.hash = self.compute_hash() if hash is None else hash
+
+    @classmethod
+    def from_position(cls, position:Position):
+        return cls(bytes(map(piece_code, position.matrix)), position.turn, position.hash)
+
+    @classmethod
+    def from_fen(cls, fen:str):
+        board = bytearray(64)
+        turn = WHITE
+        idx = 0
+        for char in fen:
+            if idx >= 64:
+                if char in 'wb':
+                    turn = WHITE if char == 'w' else BLACK
+                    break
+                continue
+            if char == '/':
+                continue
+            if char.isnumeric():
+                idx += int(char)
+                continue
+            board[idx] = fen_code(char)
+            idx += 1
+        return cls(board, turn)
 
-        function, arg = functions.get(self.move_type, (self.default_notation, "none"))
+    def to_position(self) -> Position:
+        position = Position.__new__(Position)
+        position.matrix = [codePieces[code] for code in self.board]
+        position.fen = None
+        position.fen_calc = None
+        position.turn = self.turn
+        position.w_king = None if self.w_king is None else boardSquares[self.w_king]
+        position.b_king = None if self.b_king is None else boardSquares[self.b_king]
+        position.load_pieces()
+        position.hash = self.hash
+        return position
 
-        if function:
-            return function(piece, arg)
-        
-        return self.default_notation(piece, arg)
-    
-    def default_notation(self, piece:Piece, arg:str) -> str:
-        suffix = piece.piece.upper() if piece.piece != 'p' else ''
-        return f"{suffix}{self.src}{self.dst}"    
+    def copy(self):
+        position = CompactPosition.__new__(CompactPosition)
+        position.board = self.board[:]
+        position.turn = self.turn
+        position.w_king = self.w_king
+        position.b_king = self.b_king
+        position.hash = self.hash
+        return position
+
+    def find_kings(self):
+        whiteKing = self.board.find(pieceCodes['k'] | WHITE_CODE)
+        blackKing = self.board.find(pieceCodes['k'])
+        self.w_king = whiteKing if whiteKing >= 0 else None
+        self.b_king = blackKing if blackKing >= 0 else None
+
+    def compute_hash(self) -> int:
+        key = 0 if self.turn else zobristTurnKey
+        for idx, code in enumerate(self.board):
+            if code:
+                key ^= zobristPieceKeys[code >= WHITE_CODE][piece_types[(code & 7) - 1]][idx]
+        return key
+
+    def piece(self, idx:int) -> Piece|None:
+        return codePieces[self.board[idx]]
+
+    def get_fen(self) -> str:
+        rows = []
+        for row in range(8):
+            fen = ''
+            emptySquares = 0
+            for code in self.board[8 * row:8 * row + 8]:
+                if not code:
+                    emptySquares += 1
+                    continue
+                if emptySquares:
+                    fen += str(emptySquares)
+                    emptySquares = 0
+                fen += str(codePieces[code])
+            if emptySquares:
+                fen += str(emptySquares)
+            rows.append(fen)
+        return '/'.join(rows) + (' w' if self.turn else ' b') + ' - - 0 1'
+
+    def __reduce__(self):
+        # pickles as the 64 bytes and two ints, e.g. to hand a root position to a worker process
+        return (CompactPosition, (bytes(self.board), self.turn, self.hash))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CompactPosition) and self.turn == other.turn and self.board == other.board
+
+    def __hash__(self) -> int:
+        return self.hash
+
+def pack_move(position:Position, src:int, dst:int) -> int:
+    """
+    src -> dst packed with the flags it has in `position`
+    """
+    piece = position.matrix[src]
+    captured = position.matrix[dst]
+    move = src | dst << 6
+    if captured:
+        if captured.color != piece.color:
+            move |= MOVE_CAPTURE
+        elif piece.piece == 'n' and captured.piece == 'r':
+            move |= MOVE_FUSION
+    if piece.piece == 'p':
+        if dst < 8 or dst >= 56:
+            move |= MOVE_PROMOTION
+        elif abs(dst - src) == 16:
+            move |= MOVE_PAWN_JUMP
+    return move
+
+def move_squares(move:int) -> tuple[Square, Square]:
+    return boardSquares[move & 63], boardSquares[(move >> 6) & 63]
+
+def uci_notation(move:int) -> str:
+    promotion = 'q' if move & MOVE_PROMOTION else ''
+    return f"{boardSquares[move & 63]}{boardSquares[(move >> 6) & 63]}{promotion}"
+
+class Move:
+    """
+    A packed move in the position it is played from. Its notation is only
+    worked out when asked for: uci() ("e7e8q") or san() ("Nbd2", "exd5",
+    "e8=Q", and "Na8=Ñ" for a Knook-lear fusion).
+    """
+    __slots__ = ('position', 'move')
+
+    def __init__(self, position:Position, move:int) -> None:
+        self.position = position
+        self.move = move
+
+    @classmethod
+    def from_squares(cls, position:Position, squareFrom:Square, squareTo:Square):
+        return cls(position, pack_move(position, squareFrom.idx, squareTo.idx))
+
+    @property
+    def src(self) -> Square:
+        return boardSquares[self.move & 63]
+
+    @property
+    def dst(self) -> Square:
+        return boardSquares[(self.move >> 6) & 63]
+
+    def uci(self) -> str:
+        return uci_notation(self.move)
+
+    def san(self) -> str:
+        move = self.move
+        src, dst = self.src, self.dst
+        piece = self.position.matrix[src.idx]
+
+        if piece.piece == 'p':
+            notation = f"{src.algebraic_str[0]}x{dst}" if move & MOVE_CAPTURE else str(dst)
+            return notation + ('=Q' if move & MOVE_PROMOTION else '')
+
+        letter = str(piece).upper()
+        if move & MOVE_FUSION:
+            return f"{letter}{self.disambiguation(piece)}{dst}={str(knooks[WHITE])}"
+        capture = 'x' if move & MOVE_CAPTURE else ''
+        return f"{letter}{self.disambiguation(piece)}{capture}{dst}"
+
+    def disambiguation(self, piece:Piece) -> str:
+        """
+        File, rank or square of the moving piece if another one of the same
+        kind could go to the same square
+        """
+        position = self.position
+        src, dst = self.src, self.dst
+        others = []
+        for idx in squares_of(position.bitboards[piece.color][piece.piece] & ~src.bit):
+            reaches = KNIGHT_ATTACKS[idx] if self.move & MOVE_FUSION else position.targets(idx)
+            if reaches & dst.bit:
+                others.append(boardSquares[idx])
+        if not others:
+            return ''
+        if all(other.col != src.col for other in others):
+            return src.algebraic_str[0]
+        if all(other.row != src.row for other in others):
+            return src.algebraic_str[1]
+        return src.algebraic_str
 
     def __str__(self) -> str:
-        pass# to do
+        return self.san()
+
+    def __repr__(self) -> str:
+        return self.uci()
 
 class ChessBoard:
     def __str__(self):
@@ -294,99 +975,52 @@ class ChessBoard:
         return self.position.get_fen()
 
     def __deepcopy__(self, memodict={}):
-        position = Position(self.position.get_fen())
-
-        this_position = self.position
-
-        position.fen = this_position.fen
-        position.w_king = this_position.w_king
-        position.b_king = this_position.b_king
-        position.turn = this_position.turn
-
-        board = ChessBoard(position, opening_book=self.opening_book)
+        board = ChessBoard(self.position.deep_copy(), opening_book=self.opening_book)
         board.turn = self.turn
         board.moves = self.moves
-        board.last_position = None
-        board.last_move = None
-        #board.history = [old for old in self.history]
-        #board.history = self.history
-
-        board.position = position
-
-        
 
         return board
 
-    def __init__(self, position, opening_book:OpeningBook = None) -> None:
+    def __init__(self, position, opening_book:OpeningBook|CompiledOpeningBook = None) -> None:
         self.position:          Position    = position
         self.turn:              bool        = self.position.turn
         self.moves:             float       = 0
-        self.last_position:     Position    = None
-        self.last_move:         Move        = None
+        self.last_move:         tuple       = None
+        self.undo_stack:        list        = []
 
-        if opening_book:
-            self.opening_book = opening_book
-        else:
-            self.opening_book = OpeningBook()
+        # None: the shared book from get_opening_book(), loaded on the first probe
+        self.opening_book = opening_book
 
     def get_theory_move(self):
-        theory = self.opening_book
-
-        current_fen = self.position.get_fen(simplify=True)
-
-        if current_fen not in theory.variations:
+        entries = (self.opening_book or get_opening_book()).get_entries(self.position)
+        if not entries:
             return None
 
-        possible_moves = theory.variations[current_fen]
-
-        random.shuffle(possible_moves)
-
-        if possible_moves:
-            move = possible_moves[0]
-            squareFrom = Square(algebraic=move.split(' ')[0])
-            squareTo = Square(algebraic=move.split(' ')[1])
-            
-            child = self.__deepcopy__()
-            child.move(squareFrom, squareTo)
-            return child
-        return None
-  
-    def get_possible_moves(self, color = None):
+        move, _weight = random.choices(entries, weights=[weight for _move, weight in entries])[0]
+        child = self.__deepcopy__()
+        child.move(boardSquares[move & 63], boardSquares[move >> 6])
+        return child
 
+    def get_move_list(self, color = None) -> array:
+        """
+        Packed moves (see pack_move) of `color`, the side to move by default
+        """
         if color is None:
             color = self.turn
+        return self.position.generate_moves(color)
 
-        matrix = self.position.matrix
-
-        position = self.position
-
-        fen = position.get_fen(simplify=True) + str(color)
-        cached = moveDiscoveryCache.get(fen)
-
-        if cached:
-            return cached
-
-        possible_moves: list[tuple[Square, Square]] = []
-
-        for idx in range (0,63):
-            piece = matrix[idx]
-            if piece:
-                if piece.color == color:
-                    movable_piece = Square(idx=idx)
-
-                    moves = Rays(position, movable_piece).squares
-
-                    for move in moves:
-                        _from = movable_piece
-                        _to   = move
-
-                        possible_moves.append((_from, _to))  
-            
-        #moveDiscoveryCache.add(fen, possible_moves)
+    def get_capture_list(self, color = None) -> array:
+        if color is None:
+            color = self.turn
+        return self.position.generate_moves(color, captures=True)
 
-        return possible_moves
+    def get_possible_moves(self, color = None) -> list[tuple[Square, Square]]:
+        return [move_squares(move) for move in self.get_move_list(color)]
 
-    def evaluate_position(self) -> float:
+    def scan_material(self) -> tuple[float, float]:
+        """
+        Material and piece-square scores computed from a full board scan
+        """
         material_count = {
             'K':0,
             'Q':0,
@@ -430,17 +1064,35 @@ class ChessBoard:
 
         positionScore = positionTableWeightFactor * (whitePositionScore - blackPositionScore)
 
-        wMobility = len(self.get_possible_moves(WHITE))
-        bMobility = len(self.get_possible_moves(BLACK))
+        return materialScore, positionScore
+
+    def get_possible_captures(self, color = None) -> list[tuple[Square, Square]]:
+        return [move_squares(move) for move in self.get_capture_list(color)]
+
+    def evaluate_position(self) -> float:
+        position = self.position
+
+        materialScore = position.material[WHITE] - position.material[BLACK]
+        positionScore = positionTableWeightFactor * (position.pst[WHITE] - position.pst[BLACK])
+
+        if CHECK_INCREMENTAL_EVAL:
+            scanned = self.scan_material()
+            if scanned != (materialScore, positionScore):
+                raise Exception(f"Incremental evaluation mismatch on {position.get_fen()}: {(materialScore, positionScore)} != {scanned}")
+
+        wMobility = position.mobility(WHITE)
+        bMobility = position.mobility(BLACK)
 
         mobilityScore = mobilityWt * (wMobility-bMobility)
 
+        # the check bonus only counts pawn, knight, bishop, rook and queen attackers
+        bitboards = position.bitboards
         if position.w_king:
-            checkingWhiteKing = 150 if Rays(position, position.w_king,'incheck').squares else 0
+            checkingWhiteKing = 150 if position.attackers(position.w_king.idx, BLACK) & ~(bitboards[BLACK]['ñ'] | bitboards[BLACK]['k']) else 0
         else:
             checkingWhiteKing = -150
         if position.b_king:
-            checkingBlackKing = 150 if Rays(position, position.b_king,'incheck').squares else 0
+            checkingBlackKing = 150 if position.attackers(position.b_king.idx, WHITE) & ~(bitboards[WHITE]['ñ'] | bitboards[WHITE]['k']) else 0
         else:
             checkingBlackKing = -150
 
@@ -448,10 +1100,22 @@ class ChessBoard:
 
         return (materialScore + mobilityScore + positionScore + checkingKingScore)
 
-    def move(self, squareFrom:Square, squareTo:Square, check_semi_legal=True):
-        self.last_position = self.position.deep_copy()
-        self.last_move = (squareFrom, squareTo)
+    def make_move(self, squareFrom:Square, squareTo:Square):
+        self.undo_stack.append(self.position.make_move(squareFrom.idx, squareTo.idx))
+        self.turn = not self.turn
+        self.moves += 0.5
 
+    def make_packed_move(self, move:int):
+        self.undo_stack.append(self.position.make_move(move & 63, (move >> 6) & 63))
+        self.turn = not self.turn
+        self.moves += 0.5
+
+    def unmake_move(self):
+        self.position.unmake_move(self.undo_stack.pop())
+        self.turn = not self.turn
+        self.moves -= 0.5
+
+    def move(self, squareFrom:Square, squareTo:Square, check_semi_legal=True):
         pieceFrom = self.position.matrix[squareFrom.idx]
         pieceTo   = self.position.matrix[squareTo.idx]
         if check_semi_legal:
@@ -465,495 +1129,1092 @@ class ChessBoard:
                 raise Exception(f"{invalid_move_text} It is {color_turn}'s turn to play, but {squareFrom.algebraic()} is not a {color_turn} piece.")
             
             if pieceTo:
-                if pieceTo.color == pieceFrom.color:
+                fusion = pieceFrom.piece == 'n' and pieceTo.piece == 'r'
+                if pieceTo.color == pieceFrom.color and not fusion:
                     invalid_move_text = f"Invalid Move ({squareFrom.algebraic()}{squareTo.algebraic()}):"
                     raise Exception(f"{invalid_move_text} Piece cannot capture a piece of the same color.")
 
-                if pieceTo.piece == 'k':
-                    if pieceTo.color == WHITE:
-                        self.position.w_king = None
-                    else:
-                        self.position.b_king = None
-            
-        #self.history.append(self.deepcopy())
-         
-        if pieceFrom.piece == 'p' and pieceFrom.color and squareTo.row == 0:
-            self.position.matrix[squareFrom.idx].piece = 'q'
-
-        elif pieceFrom.piece == 'p' and not pieceFrom.color and squareTo.row == 7:
-            self.position.matrix[squareFrom.idx].piece = 'q'
-
-        if pieceFrom.piece == 'k':
-            if pieceFrom.color == WHITE:
-                self.position.w_king = squareTo
-            else:
-                self.position.b_king = squareTo
-
-        self.position.matrix[squareTo.idx] = self.position.matrix[squareFrom.idx]
-        self.position.matrix[squareFrom.idx] = None
-
-        self.position.turn = not self.turn
-        self.turn = not self.turn
-        
-        self.moves += 0.5
-
-        self.position.get_fen()
-
-        #self.position.fen = self.position.get_fen()
+        self.last_move = (squareFrom, squareTo)
+        self.make_move(squareFrom, squareTo)
+
+class TranspositionTable:
+    """
+    Fixed-size hash table of search results.
+
+    Entries are two 64-bit words in one flat buffer: the position hash xored
+    with the data word, and the data word itself
+    (move:16 | depth:8 | bound:2 | generation:6 | score:32). Buckets hold a
+    depth-preferred entry followed by an always-replace entry.
+    """
+    ENTRY_BYTES = 16
+    SCORE_SCALE = 100
+    SCORE_INF = (1 << 31) - 1
+
+    def __init__(self, size_mb:float=hashSizeMb, buffer=None) -> None:
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.resize(size_mb, buffer)
+
+    @classmethod
+    def table_bytes(cls, size_mb:float) -> int:
+        """
+        Bytes of the buffer a table of `size_mb` uses, a whole number of buckets
+        """
+        return max(1, int(size_mb * 1024 * 1024) // (2 * cls.ENTRY_BYTES)) * 2 * cls.ENTRY_BYTES
+
+    def resize(self, size_mb:float, buffer=None):
+        size = self.table_bytes(size_mb)
+        self.buckets = size // (2 * self.ENTRY_BYTES)
+        if buffer is None:
+            buffer = bytearray(size)
+        self.table = memoryview(buffer)[:size].cast('Q')
+        self.size_mb = size_mb
+
+    def release(self):
+        # a table over shared memory must let go of it before the memory is closed
+        self.table.release()
+
+    def clear(self):
+        # zeroed in place, a shared table must keep its buffer
+        raw = self.table.cast('B')
+        zeros = bytes(min(len(raw), 1 << 20))
+        for start in range(0, len(raw), len(zeros)):
+            end = min(start + len(zeros), len(raw))
+            raw[start:end] = zeros[:end - start]
+        raw.release()
+        self.generation = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 63
+        self.probes = 0
+        self.hits = 0
+
+    def pack_score(self, score:float) -> int:
+        if score == math.inf:
+            value = self.SCORE_INF
+        elif score == -math.inf:
+            value = -self.SCORE_INF
+        else:
+            value = max(-self.SCORE_INF + 1, min(self.SCORE_INF - 1, round(score * self.SCORE_SCALE)))
+        return value + (1 << 31)
+
+    def unpack_score(self, packed:int) -> float:
+        value = packed - (1 << 31)
+        if value == self.SCORE_INF:
+            return math.inf
+        if value == -self.SCORE_INF:
+            return -math.inf
+        return value / self.SCORE_SCALE
+
+    def probe(self, key:int) -> tuple[int, int, float, int] | None:
+        """
+        Returns (move, depth, score, bound) stored for `key`, move being from | to << 6 (0 if none)
+        """
+        self.probes += 1
+        table = self.table
+        idx = (key % self.buckets) * 4
+        for slot in (idx, idx + 2):
+            data = table[slot + 1]
+            if table[slot] ^ data == key and data:
+                self.hits += 1
+                return (data & 0xFFFF, (data >> 16) & 0xFF, self.unpack_score(data >> 32), (data >> 24) & 3)
+        return None
 
-class RookRays:
-    def __init__(self, position:Position, square:Square):
-        #self.square = square
-        #self.matrix = position.matrix
+    def store(self, key:int, move:int, depth:int, score:float, bound:int):
+        table = self.table
+        idx = (key % self.buckets) * 4
 
-        self.squares = self.calculateContinuousLines(square, position.matrix, paddings=[(-1, 0), ( 1, 0), ( 0,-1), ( 0, 1)])
-    
-    def calculateContinuousLines(self, square, matrix, paddings):
-        squares:list[Square] = []
-        
-        piece = matrix[(8 * (square.row)) + square.col]    
-        
-        for padding in paddings:
-            col = square.col
-            row = square.row
+        data = table[idx + 1]
+        same = table[idx] ^ data == key
+        if same or not data or depth >= (data >> 16) & 0xFF or (data >> 26) & 63 != self.generation:
+            slot = idx
+        else:
+            slot = idx + 2
+            data = table[slot + 1]
+            same = table[slot] ^ data == key
+
+        if same and not move:
+            move = data & 0xFFFF
+
+        data = move | (min(depth, 255) << 16) | (bound << 24) | (self.generation << 26) | (self.pack_score(score) << 32)
+        table[slot] = key ^ data
+        table[slot + 1] = data
+
+class SearchStats:
+    """
+    Counters of one single-threaded search. Nodes are split into interior
+    nodes, horizon (leaf) nodes and quiescence nodes past the horizon;
+    times are cumulative seconds.
+    """
+    def __init__(self) -> None:
+        self.interior_nodes = 0
+        self.leaf_nodes = 0
+        self.quiescence_nodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.movegen_calls = 0
+        self.movegen_time = 0.0
+        self.eval_calls = 0
+        self.eval_time = 0.0
+        self.seldepth = 0
+        self.iteration_nodes = []   # nodes searched by each completed iteration
+        self.root = 0               # undo stack height at the root, plies are measured from it
+
+    def nodes(self) -> int:
+        return self.interior_nodes + self.leaf_nodes + self.quiescence_nodes
+
+    def first_move_cutoff_ratio(self) -> float:
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0
+
+    def branching_factors(self) -> list[float]:
+        """
+        Effective branching factor of each iteration after the first: its
+        nodes over the previous iteration's
+        """
+        iterations = self.iteration_nodes
+        return [current / previous if previous else 0 for previous, current in zip(iterations, iterations[1:])]
+
+    def as_dict(self) -> dict:
+        stats = {key: value for key, value in vars(self).items() if key != 'root'}
+        stats['nodes'] = self.nodes()
+        stats['first_move_cutoff_ratio'] = self.first_move_cutoff_ratio()
+        stats['branching_factors'] = self.branching_factors()
+        return stats
+
+class SearchAborted(Exception):
+    pass
+
+class SearchLimits:
+    """
+    Stopping rules for getBestMove. Times are in milliseconds, as in UCI.
+    With no limit at all the search keeps the old fixed depth (4, or 5 when
+    there are fewer than 10 moves).
+    """
+    CHECK_INTERVAL = 256
+    MOVE_OVERHEAD = 30
+
+    def __init__(self, depth:int=None, nodes:int=None, movetime:float=None, wtime:float=None, btime:float=None,
+                 winc:float=0, binc:float=0, movestogo:int=None, infinite:bool=False) -> None:
+        self.depth = depth
+        self.nodes = nodes
+        self.movetime = movetime
+        self.wtime = wtime
+        self.btime = btime
+        self.winc = winc
+        self.binc = binc
+        self.movestogo = movestogo
+        self.infinite = infinite
+
+        self.stopped = False
+        self.stop_event = None  # StopSignal of a Lazy SMP worker
+        self.deadline = None
+        self.soft_deadline = None
+        self.next_check = math.inf
+        self.t0 = time.monotonic()
+
+    def arguments(self) -> dict:
+        return {
+            'depth': self.depth, 'nodes': self.nodes, 'movetime': self.movetime,
+            'wtime': self.wtime, 'btime': self.btime, 'winc': self.winc, 'binc': self.binc,
+            'movestogo': self.movestogo, 'infinite': self.infinite,
+        }
 
-            idx = (8 * (row)) + col
+    def unlimited(self) -> bool:
+        return not (self.infinite or self.depth or self.nodes or self.movetime or self.wtime or self.btime)
 
-            for _i in range(8):
-                col += padding[0]
-                row += padding[1] 
-                idx = (8 * (row)) + col
-                if  col < 0 or col >= 8 or row < 0 or row >= 8:
-                    break
-                if matrix[idx]:    
-                    if matrix[idx].color == piece.color:
-                        break
-                    else:
-                        squares.append(Square(idx=idx))
-                        break
-                squares.append(Square(idx=idx))
-            
-        return squares
+    def start(self, turn:bool):
+        # a stop that came in before the search thread got here still counts
+        self.t0 = time.monotonic()
+        self.deadline = self.soft_deadline = None
 
-class QueenRays:
-    def __init__(self, position:Position, square:Square):
-        #self.square = square
-        #self.matrix = position.matrix
-        
-        self.squares: list[Square] = self.calculateContinuousLines(square, position.matrix, 
-            paddings=[(-1,-1), (-1, 1), ( 1,-1), ( 1, 1), (-1, 0), ( 1, 0), ( 1, 0), ( 0,-1), ( 0, 1)])
+        if self.movetime:
+            self.deadline = self.t0 + max(self.movetime - self.MOVE_OVERHEAD, 1) / 1000
+        else:
+            remaining = self.wtime if turn else self.btime
+            if remaining:
+                increment = (self.winc if turn else self.binc) or 0
+                budget = remaining / (self.movestogo or 30) + 0.75 * increment
+                budget = max(min(budget, remaining - self.MOVE_OVERHEAD), 1)
+                self.deadline = self.t0 + budget / 1000
+                # an iteration started after half the budget rarely finishes in time
+                self.soft_deadline = self.t0 + budget / 2000
+
+        self.next_check = self.CHECK_INTERVAL if (self.deadline or self.nodes or self.stop_event) else math.inf
+        if self.stopped:
+            self.next_check = 0
+
+    def stop(self):
+        self.stopped = True
+        self.next_check = 0
+
+    def check(self, searched:int):
+        """
+        Raises SearchAborted once a limit is hit, called every CHECK_INTERVAL nodes
+        """
+        if self.stopped:
+            raise SearchAborted()
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchAborted()
+        if self.nodes and searched >= self.nodes:
+            raise SearchAborted()
+        if self.deadline and time.monotonic() >= self.deadline:
+            raise SearchAborted()
+        self.next_check = searched + self.CHECK_INTERVAL
+        if self.nodes:
+            self.next_check = min(self.next_check, self.nodes)
+
+    def keep_deepening(self, depth:int) -> bool:
+        if self.stopped or depth >= (self.depth or maxSearchDepth):
+            return False
+        if self.stop_event is not None and self.stop_event.is_set():
+            return False
+        if self.nodes and nodes >= self.nodes:
+            return False
+        if self.soft_deadline and time.monotonic() >= self.soft_deadline:
+            return False
+        return True
+
+def reset_move_ordering():
+    global killerMoves, historyTable, cutoffs, firstMoveCutoffs
+    killerMoves = [[0, 0] for _ply in range(maxSearchDepth + 1)]
+    historyTable = [[0] * 4096, [0] * 4096]  # [color][from | to << 6]
+    cutoffs = 0
+    firstMoveCutoffs = 0
+
+def order_moves(position:Position, possible_moves:array, ttMove:int, ply:int) -> list[int]:
+    """
+    Hash move first, then captures by MVV-LVA, the two killers of this ply
+    and the remaining quiet moves by history score
+    """
+    matrix = position.matrix
+    killers = killerMoves[ply]
+    history = historyTable[position.turn]
+
+    scored = []
+    for move in possible_moves:
+        key = move & MOVE_SQUARES
+        if move == ttMove:
+            score = 3000000
+        elif move & MOVE_CAPTURE:
+            score = 2000000 + 100 * piece_point_chart[matrix[key >> 6].piece] - piece_point_chart[matrix[key & 63].piece]
+        elif key == killers[0]:
+            score = 1000002
+        elif key == killers[1]:
+            score = 1000001
+        else:
+            score = history[key]
+        scored.append((score, move))
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [move for _score, move in scored]
+
+def record_cutoff(position:Position, move:int, depth:int, ply:int, moveNumber:int):
+    global cutoffs, firstMoveCutoffs
+    cutoffs += 1
+    if not moveNumber:
+        firstMoveCutoffs += 1
+
+    if move & MOVE_CAPTURE:
+        return
+
+    key = move & MOVE_SQUARES
+    killers = killerMoves[ply]
+    if killers[0] != key:
+        killers[1] = killers[0]
+        killers[0] = key
+
+    history = historyTable[position.turn]
+    history[key] += depth * depth
+    if history[key] > 1000000:
+        for color_history in historyTable:
+            for idx, value in enumerate(color_history):
+                color_history[idx] = value // 2
+
+def side_score(board:ChessBoard) -> float:
+    """
+    Static evaluation from the side to move's point of view
+    """
+    stats = searchStats
+    if stats:
+        t0 = time.perf_counter()
+        evaluation = board.evaluate_position()
+        stats.eval_time += time.perf_counter() - t0
+        stats.eval_calls += 1
+    else:
+        evaluation = board.evaluate_position()
+    return evaluation if board.position.turn else -evaluation
+
+def king_captured(position:Position) -> float:
+    """
+    -inf if the side to move has lost its king, inf if the opponent has, else 0
+    """
+    if position.turn:
+        own, other = position.w_king, position.b_king
+    else:
+        own, other = position.b_king, position.w_king
+    if not own:
+        return -math.inf
+    if not other:
+        return math.inf
+    return 0
+
+def quiescence(board:ChessBoard, alpha, beta, qply=0):
+    """
+    Captures-only negamax past the horizon, stands pat on the static evaluation
+    """
+    global nodes, quiescenceNodes
 
-    def calculateContinuousLines(self, square, matrix, paddings):
-        squares:list[Square] = []
+    nodes += 1
+    quiescenceNodes += 1
 
-        piece = matrix[(8 * (square.row)) + square.col]
+    if nodes >= searchLimits.next_check:
+        searchLimits.check(nodes)
 
-        for padding in paddings:
+    stats = searchStats
+    if stats:
+        if qply:
+            stats.quiescence_nodes += 1
+        else:
+            stats.leaf_nodes += 1
+        ply = len(board.undo_stack) - stats.root
+        if ply > stats.seldepth:
+            stats.seldepth = ply
 
-            col = square.col
-            row = square.row
-            idx = (8 * (row)) + col
-            
-            for _i in range(8):
-                col += padding[0]
-                row += padding[1] 
-                idx = (8 * (row)) + col
-                if  col < 0 or col >= 8 or row < 0 or row >= 8:
-                    break
+    position = board.position
 
-                if matrix[idx]:    
-                    if matrix[idx].color == piece.color:
-                        break
-                    else:
-                        squares.append(Square(idx=idx))
-                        break
+    terminal = king_captured(position)
+    if terminal:
+        return terminal
 
-                squares.append(Square(idx=idx))
-            
-        return squares
+    standPat = side_score(board)
 
-class BishopRays:
-    def __init__(self, position:Position, square:Square):
-        #self.square = square
-        #self.matrix = position.matrix
-        
-        self.squares = self.calculateContinuousLines(square, position.matrix, paddings=[(-1,-1), (-1, 1), ( 1,-1), ( 1, 1)])
+    if standPat >= beta:
+        return standPat
+    alpha = max(alpha, standPat)
 
-    
-    def calculateContinuousLines(self, square, matrix, paddings):
-        squares:list[Square] = []
+    if qply >= maxQuiescenceDepth or quiescenceNodes >= maxQuiescenceNodes:
+        return standPat
 
-        piece = matrix[(8 * (square.row)) + square.col]
+    matrix = position.matrix
+    if stats:
+        t0 = time.perf_counter()
+        captures = board.get_capture_list()
+        stats.movegen_time += time.perf_counter() - t0
+        stats.movegen_calls += 1
+    else:
+        captures = board.get_capture_list()
+    captures = sorted(captures, key=lambda move: 100 * piece_point_chart[matrix[(move >> 6) & 63].piece] - piece_point_chart[matrix[move & 63].piece], reverse=True)
+
+    bestEval = standPat
+
+    for move in captures:
+        victim = matrix[(move >> 6) & 63]
+        if victim.piece != 'k':
+            # delta pruning: skip captures that cannot bring the score back to the window
+            gain = pieceWeights[victim.piece] + deltaMargin
+            if move & MOVE_PROMOTION:
+                gain += queenWt - pawnWt
+            if standPat + gain <= alpha:
+                continue
 
-        for padding in paddings:
-            col = square.col
-            row = square.row
-            idx = (8 * (row)) + col
+        board.make_packed_move(move)
+        evaluation = -quiescence(board, -beta, -alpha, qply + 1)
+        board.unmake_move()
 
-            for _i in range(8):
-                col += padding[0]
-                row += padding[1] 
-                idx = (8 * (row)) + col
-                if  col < 0 or col >= 8 or row < 0 or row >= 8:
+        if evaluation > bestEval:
+            bestEval = evaluation
+            if evaluation > alpha:
+                alpha = evaluation
+                if alpha >= beta:
                     break
-                if matrix[idx]:    
-                    if matrix[idx].color == piece.color:
-                        break
-                    else:
-                        squares.append(Square(idx=idx))
-                        break
-                squares.append(Square(idx=idx))
-            
-        return squares
-
-class KnightRays:
-    def __init__(self, position:Position, square:Square):
-        self.squares = self.add_vectors(square, position.matrix, [( 1, 2), (-1, 2), ( 1,-2), (-1,-2), ( 2, 1), (-2, 1), ( 2,-1), (-2,-1)] )
 
+    return bestEval
 
-    def add_vectors(self, square, matrix, vectors):
-        squares = []
+def negamax(board:ChessBoard, depth, alpha, beta, ply=0):
+    """
+    Principal variation search. Scores are from the side to move's point of
+    view; returns (best packed move, score).
+    """
+    global nodes, quiescenceNodes, pvsResearches
 
-        for vector in vectors:
-            col = vector[0] + square.col
-            row = vector[1] + square.row
+    position = board.position
 
-            if col < 0 or col >= 8 or row < 0 or row >= 8:
-                continue
-            
-            new_square = Square(col=col, row=row)
-
-            if matrix[new_square.idx]:
-                if matrix[square.idx].color == matrix[new_square.idx].color:
-                    continue
-            
-            squares.append(new_square)
-        return squares
-
-class KingRays:
-    def __init__(self, position:Position, square:Square):
-        self.squares = self.add_vectors(square, position.matrix,
-         [(-1,-1), (-1, 1), (-1, 0), ( 0,-1), ( 0, 1), ( 1,-1), ( 1, 1), ( 1, 0)])
-   
-
-    def add_vectors(self, square, matrix, vectors, debug=False):
-        squares = []
+    if depth <= 0:
+        quiescenceNodes = 0
+        return None, quiescence(board, alpha, beta)
 
-        for vector in vectors:
-            col = vector[0] + square.col
-            row = vector[1] + square.row
+    nodes += 1
 
-            if col < 0 or col >= 8 or row < 0 or row >= 8:
-                continue
-            
-            new_square = Square(col=col, row=row)
+    if nodes >= searchLimits.next_check:
+        searchLimits.check(nodes)
 
-            if matrix[new_square.idx]:
-                if matrix[square.idx].color == matrix[new_square.idx].color:
-                    continue
-            
-            squares.append(new_square)
-        return squares
+    stats = searchStats
+    if stats:
+        stats.interior_nodes += 1
 
-class PawnRays:
-    def __init__(self, position:Position, square:Square):
-        piece = position.matrix[square.idx]
-        add_vectors = self.add_vectors
+    terminal = king_captured(position)
+    if terminal:
+        return None, terminal
 
-        squares: list[Square] = []
-
-        if piece.color == WHITE:
-            squares.extend(add_vectors(square, position.matrix, [(-1,-1), ( 1,-1)] , invert_flag=True))
-            squares.extend(add_vectors(square, position.matrix, [( 0,-1)] ))
+    if stats:
+        t0 = time.perf_counter()
+        possible_moves = board.get_move_list()
+        stats.movegen_time += time.perf_counter() - t0
+        stats.movegen_calls += 1
+    else:
+        possible_moves = board.get_move_list()
+
+    if not possible_moves:
+        return None, side_score(board)
+
+    alphaOrig = alpha
+
+    entry = transpositionTable.probe(position.hash)
+    ttMove = 0
+    if entry:
+        ttMove, ttDepth, ttScore, ttBound = entry
+        if ply and ttDepth >= depth:
+            if ttBound == EXACT:
+                if stats:
+                    stats.tt_cutoffs += 1
+                return None, ttScore
+            if ttBound == LOWER_BOUND:
+                alpha = max(alpha, ttScore)
+            elif ttBound == UPPER_BOUND:
+                beta = min(beta, ttScore)
+            if alpha >= beta:
+                if stats:
+                    stats.tt_cutoffs += 1
+                return None, ttScore
+
+    possible_moves = order_moves(position, possible_moves, ttMove, ply)
+
+    bestMove: int = None
+    bestEval = -math.inf
+
+    for moveNumber, move in enumerate(possible_moves):
+        board.make_packed_move(move)
+        if moveNumber == 0 or alpha == -math.inf:
+            evaluation = -negamax(board, depth-1, -beta, -alpha, ply+1)[1]
         else:
-            squares.extend(add_vectors(square, position.matrix, [( 1, 1), (-1, 1)] , invert_flag=True))
-            squares.extend(add_vectors(square, position.matrix, [( 0, 1)] ))
-
-        self.squares = squares
-
-    def add_vectors(self, square, matrix, vectors, invert_flag = False):
-        squares = []
-
-        for vector in vectors:
-            col = vector[0] + square.col
-            row = vector[1] + square.row
-
-            if col < 0 or col >= 8 or row < 0 or row >= 8:
-                continue
-            
-            new_square = Square(col=col, row=row)
-
-
-            if matrix[new_square.idx]:
-                if matrix[new_square.idx].color == matrix[square.idx].color:
-                    continue
-                if not invert_flag:
-                    continue
-            else:
-                if invert_flag:
-                    continue
-            
-        
-            squares.append(new_square)
-        return squares
-
-class Rays:
-    def __init__(self, position:Position, square:Square, type='move') -> None:
-        matrix = position.matrix
-
-        piece = matrix[square.idx]
-        
-        if type == 'incheck':
-            self.squares = KingCheckRays(position, square).squares
-        elif piece.piece == 'p':
-            if type == 'move' or 'attack':
-                self.squares = PawnRays(position, square).squares
-        elif piece.piece == 'b':
-            self.squares = BishopRays(position, square).squares
-        elif piece.piece == 'q':
-            self.squares = QueenRays(position, square).squares
-        elif piece.piece == 'n':
-            self.squares = KnightRays(position, square).squares
-        elif piece.piece == 'r':
-            self.squares = RookRays(position, square).squares
-        elif piece.piece == 'k':
-            self.squares = KingRays(position, square).squares
-            
-
-class TranspositionCache:
-    def __init__(self) -> None:
-        self.store = {}
-
-    def add(self, fen, result:tuple[ChessBoard, float]):
-        self.store[fen] = result
-
-    def get(self, fen) -> tuple[ChessBoard, float] | None:
-        store = self.store
-        if fen in store:
-            return store[fen]
-        return None
-
-class MoveDiscoveryCache:
-    def __init__(self) -> None:
-        self.store = {}
-
-    def add(self, fen, result:list):
-        self.store[fen] = result
-
-    def get(self, fen) -> list | None:
-        store = self.store
-        if fen in store:
-            return store[fen]
-        return None
-
-class KingCheckRays:
-    def __init__(self, position:Position, square:Square):
-        matrix = position.matrix
-        piece = matrix[square.idx]
-
-        calculateContinuousLines = self.calculateContinuousLines
-        add_vectors = self.add_vectors
-
-        squares: list[Square] = []
-
-        squares.extend(calculateContinuousLines(square, matrix, piece, ['b','q'], paddings=[(-1,-1), (-1, 1), ( 1,-1), ( 1, 1)]))
-        squares.extend(calculateContinuousLines(square, matrix, piece, ['r','q'], paddings=[(-1, 0),( 1, 0), ( 0,-1), ( 0, 1)]))
-
-        squares.extend(add_vectors(square, matrix, piece, [( 1, 2),(-1, 2),( 1,-2),(-1,-2),( 2, 1),(-2, 1),( 2,-1),(-2,-1)], ['n'] ))
-      
-
-        if piece.color:
-            squares.extend(add_vectors(square, matrix, piece, [(-1,-1),( 1,-1)], ['p'] ))
+            # null window: only prove the move is no better than alpha
+            evaluation = -negamax(board, depth-1, -alpha-nullWindowWidth, -alpha, ply+1)[1]
+            if alpha < evaluation < beta:
+                pvsResearches += 1
+                evaluation = -negamax(board, depth-1, -beta, -alpha, ply+1)[1]
+        board.unmake_move()
+
+        if evaluation > bestEval or bestMove is None:
+            bestEval = evaluation
+            bestMove = move
+
+        if evaluation > alpha:
+            alpha = evaluation
+
+        if alpha >= beta:
+            record_cutoff(position, move, depth, ply, moveNumber)
+            break
+
+    if bestEval <= alphaOrig:
+        bound = UPPER_BOUND
+    elif bestEval >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+
+    transpositionTable.store(position.hash, bestMove, depth, bestEval, bound)
+
+    return bestMove, bestEval
+
+def search_root(board:ChessBoard, depth:int, previous:float|None):
+    """
+    One iteration of the root search, inside an aspiration window around the
+    previous iteration's score. The window is widened on the failing side
+    and the search repeated until the score falls inside it.
+    """
+    global aspirationResearches
+
+    if previous is None or abs(previous) == math.inf:
+        return negamax(board, depth, -math.inf, math.inf)
+
+    delta = aspirationWindow
+    alpha, beta = previous - delta, previous + delta
+    while True:
+        move, score = negamax(board, depth, alpha, beta)
+        # a lost (or won) king fails low (high) against any window, even an open one
+        if score <= alpha and alpha != -math.inf:
+            alpha = -math.inf if delta >= 4 * aspirationWindow else score - delta
+        elif score >= beta and beta != math.inf:
+            beta = math.inf if delta >= 4 * aspirationWindow else score + delta
         else:
-            squares.extend(add_vectors(square, matrix, piece, [(-1,1),( 1,1)], ['p'] ))
-
-
-        self.squares = squares
-
-    def add_vectors(self, square, matrix, piece, vectors, pieces):
-        squares = []
-
-        for vector in vectors:
-            col = vector[0] + square.col
-            row = vector[1] + square.row
-
-            if col < 0 or col >= 8 or row < 0 or row >= 8:
-                continue
-            
-            new_square = Square(col=col, row=row)
-
-            if matrix[new_square.idx]:
-                if piece.color == matrix[new_square.idx].color:
-                    continue
-                if matrix[new_square.idx].piece in pieces:
-                    squares.append(new_square)
-            
-        return squares
-    
-    def calculateContinuousLines(self, square, matrix, piece, pieces, paddings):
-        squares:list[Square] = []
-        col = square.col
-        row = square.row
-        idx = (8 * (row)) + col
-
-        for padding in paddings:
-            col = square.col
-            row = square.row
-            for _i in range(8):
-                col += padding[0]
-                row += padding[1] 
-                idx = (8 * (row)) + col
-                if  col < 0 or col >= 8 or row < 0 or row >= 8:
+            return move, score
+        delta *= 2
+        aspirationResearches += 1
+
+def iterative_deepening(game:ChessBoard, limits:SearchLimits, startDepth:int=1, on_iteration=None):
+    """
+    Deepens from `startDepth` until `limits` stop it. An interrupted
+    iteration is thrown away; returns the move and score (side to move's
+    point of view) of the last completed one, and its depth.
+    """
+    global searchLimits
+
+    searchLimits = limits
+    limits.start(game.turn)
+
+    rootDepth = len(game.undo_stack)
+    bestMove, bestMoveValue, completedDepth = None, None, 0
+
+    stats = searchStats
+    if stats:
+        stats.root = rootDepth
+    searchedBefore = nodes
+
+    depth = startDepth - 1
+    try:
+        while True:
+            depth += 1
+            try:
+                move, value = search_root(game, depth, bestMoveValue)
+            except SearchAborted:
+                while len(game.undo_stack) > rootDepth:
+                    game.unmake_move()
+                if bestMove is not None:
                     break
+                # nothing to play yet: finish this iteration whatever the limits say
+                limits.stopped = True
+                limits.next_check = math.inf
+                depth -= 1
+                continue
 
-                if matrix[idx]:    
-                    if matrix[idx].color == piece.color:
-                        break
-                    else:
-                        if matrix[idx].piece in pieces:
-                            squares.append(Square(idx=idx))
-                        break
-
-                #self.piece
-            
-        return squares
-
-def minimax(board:ChessBoard, depth, alpha, beta, maximizingPlayer):
-    global nodes
-    #print("depth:",depth)
-    """if not board.position.w_king:
-        return None, -10000
-    if not board.position.b_king:
-        return None, 10000"""
-
-    nodes += 1
-
-    possible_moves = board.get_possible_moves()
-
-    if depth is None:
-        if len(possible_moves) < 10:
-            depth = 5
-        else:
-            depth = 4
-
-    if depth == 4 and DEBUG:
-        print(possible_moves)
-
-    if not board.position.b_king:
-        return None, math.inf
-
-    if not board.position.w_king:
-        return None, -math.inf
-
-    #random.shuffle(possible_moves)
-
-    if depth == 0 or not possible_moves:
-        return None, board.evaluate_position()
-
-    bestMove: ChessBoard = None
-
-    if maximizingPlayer:
-        maxEval = -math.inf
-
-        for move in possible_moves:
-            squareFrom, squareTo = move
-            
-            key = board.position.get_fen(simplify=True) + str(squareFrom.idx) + '_' + str(squareTo.idx) + str(depth)
-            cached = transpositionCache.get(key)
-            if cached:
-                childboard = cached[0]
-                evaluation = cached[1]
-                nodes += 1
-            else:
-                childboard = board.__deepcopy__()
-                childboard.move(squareFrom, squareTo)
-                _gameobject, evaluation = minimax(childboard, depth-1, alpha, beta, not maximizingPlayer)
-                transpositionCache.add(key,(childboard, evaluation))
-
-            if evaluation > maxEval:
-                maxEval = evaluation
-                bestMove = childboard
-
-            alpha = max(alpha, maxEval)
-
-            if beta <= alpha:
-                break  
+            bestMove, bestMoveValue, completedDepth = move, value, depth
+            if stats:
+                stats.iteration_nodes.append(nodes - searchedBefore)
+            searchedBefore = nodes
+            if on_iteration:
+                on_iteration(move, value, depth)
+            if DEBUG:
+                print(f"depth {depth}: {uci_notation(move) if move is not None else None} {value if game.turn else -value}")
 
-            
-        
-        return bestMove, maxEval
-    
-    else:
-        minEval = math.inf
+            if abs(value) == math.inf or move is None or not limits.keep_deepening(depth):
+                break
+    finally:
+        searchLimits = SearchLimits()
 
-        for move in possible_moves:
-            squareFrom, squareTo = move
+    return bestMove, bestMoveValue, completedDepth
 
+def build_result(game:ChessBoard, move:int|None, bestMoveValue, debugParams:dict) -> tuple[ChessBoard, float, ResultDebug]:
+    if bestMoveValue is not None and not game.turn:
+        bestMoveValue = -bestMoveValue  # reported from white's point of view
 
-            key = board.position.get_fen(simplify=True) + str(squareFrom.idx) + '_' + str(squareTo.idx) + str(depth)
-            cached = transpositionCache.get(key)
-            if cached:
-                childboard = cached[0]
-                evaluation = cached[1]
-            else:
-                childboard = board.__deepcopy__()
-                childboard.move(squareFrom, squareTo)
-                _gameobject, evaluation = minimax(childboard, depth-1, alpha, beta, not maximizingPlayer)
-                transpositionCache.add(key,(childboard, evaluation))
+    bestMove = None
+    if move is not None:
+        bestMove = game.__deepcopy__()
+        bestMove.move(*move_squares(move))
 
-            #minEval = min(minEval, evaluation)
-            if evaluation < minEval:
-                minEval = evaluation
-                bestMove = childboard
+    debugParams.update({
+        'pre_static': game.evaluate_position(),
+        'post_static': bestMove.evaluate_position() if bestMove else None,
+        'post_dynamic': bestMoveValue
+    })
 
-            beta = min(beta, evaluation) #min(beta, minEval)
+    return (bestMove, bestMoveValue, ResultDebug(debugParams))
+
+def principal_variation(board:ChessBoard, first:int, maxLength:int=maxSearchDepth) -> list[int]:
+    """
+    Packed move `first` followed by the hash moves stored after it, as long
+    as they are playable and do not repeat a position
+    """
+    table = transpositionTable
+    probes, hits = table.probes, table.hits
+    position = board.position
+    line = []
+    seen = set()
+
+    move = first
+    while move is not None and len(line) < maxLength and position.hash not in seen:
+        src, dst = move & 63, (move >> 6) & 63
+        piece = position.matrix[src]
+        if not piece or piece.color != position.turn or not position.targets(src) >> dst & 1:
+            break
+        seen.add(position.hash)
+        line.append(pack_move(position, src, dst))
+        board.make_packed_move(move)
+        if king_captured(position):
+            break
+
+        entry = table.probe(position.hash)
+        move = entry[0] if entry and entry[0] else None
+
+    for _move in line:
+        board.unmake_move()
+    table.probes, table.hits = probes, hits
+    return line
+
+def getBestMove(game:ChessBoard, limits:SearchLimits=None, threads:int=None, on_iteration=None) -> tuple[ChessBoard, float, ResultDebug]:
+    """
+    Book move if there is one, else an iterative deepening search within
+    `limits`, on `threads` Lazy SMP workers (searchThreads by default).
+    `on_iteration(move, value, depth)` is called with the packed move after
+    each completed iteration of a single-threaded search.
+    """
+    global nodes, pvsResearches, aspirationResearches, searchStats
 
-            if beta <= alpha:
-                break   
-        
-        return bestMove, minEval
+    nodes = 0
+    pvsResearches = 0
+    aspirationResearches = 0
+    searchStats = SearchStats() if collectSearchStats else None
 
-def getBestMove(game:ChessBoard) -> tuple[ChessBoard, float, ResultDebug]:
-    global nodes
+    transpositionTable.new_search()
+    reset_move_ordering()
 
-    nodes = 0
+    t0 = time.monotonic()
 
     theory_move = game.get_theory_move()
 
     if theory_move:
-        return [theory_move, theory_move.evaluate_position()]
+        evaluation = theory_move.evaluate_position()
+        return (theory_move, evaluation, ResultDebug({
+            'nodes': 0,
+            'duration': max(time.monotonic() - t0, 0.001),
+            'depth': 0,
+            'pre_static': game.evaluate_position(),
+            'post_static': evaluation,
+            'post_dynamic': evaluation,
+        }))
 
-    depth = None
+    if limits is None:
+        limits = SearchLimits()
 
-    t0 = time.monotonic()
+    possible_moves = game.get_move_list()
 
-    bestMove, bestMoveValue = minimax(
-        game,
-        depth,
-        -math.inf,
-        math.inf,
-       True
-    )
+    if DEBUG:
+        print([uci_notation(move) for move in possible_moves])
 
-    
-    t1 = time.monotonic()
+    if limits.unlimited():
+        limits.depth = 5 if len(possible_moves) < 10 else 4
 
-    duration = t1-t0
+    threads = threads or searchThreads
+    if threads > 1:
+        return lazy_smp_search(game, limits, threads, t0)
+
+    bestMove, bestMoveValue, completedDepth = iterative_deepening(game, limits, on_iteration=on_iteration)
+
+    duration = time.monotonic() - t0
 
     if not duration:
         duration = 0.001
 
-    debug = ResultDebug({
+    stats = searchStats
+    if stats:
+        stats.tt_probes = transpositionTable.probes
+        stats.tt_hits = transpositionTable.hits
+        stats.beta_cutoffs = cutoffs
+        stats.first_move_cutoffs = firstMoveCutoffs
+
+    return build_result(game, bestMove, bestMoveValue, {
         'nodes': nodes,
         'duration': duration,
-        'pre_static': game.evaluate_position(),
-        'post_static': bestMove.evaluate_position(),
-        'post_dynamic': bestMoveValue
+        'depth': completedDepth,
+        'cutoffs': cutoffs,
+        'first_move_cutoff_rate': firstMoveCutoffs / cutoffs if cutoffs else 0,
+        'pvs_researches': pvsResearches,
+        'aspiration_researches': aspirationResearches,
+        'tt_hit_rate': transpositionTable.hits / transpositionTable.probes if transpositionTable.probes else 0,
+        'stats': stats,
     })
 
-
-    return (bestMove, bestMoveValue, debug)
+def share_transposition_table() -> str:
+    """
+    Moves the transposition table into shared memory so worker processes
+    can attach to it, returns the name of the shared block
+    """
+    global transpositionTable, sharedTableMemory
+
+    table = transpositionTable
+    if sharedTableMemory is not None and table.size_mb == hashSizeMb:
+        return sharedTableMemory.name
+
+    memory = shared_memory.SharedMemory(create=True, size=TranspositionTable.table_bytes(hashSizeMb))
+
+    release_shared_table()
+    transpositionTable = TranspositionTable(hashSizeMb, buffer=memory.buf)
+    transpositionTable.generation = table.generation
+    sharedTableMemory = memory
+    return memory.name
+
+def set_hash_size(sizeMb:float):
+    """
+    Replaces the transposition table with an empty one of `sizeMb`
+    """
+    global hashSizeMb, transpositionTable
+    release_shared_table()
+    hashSizeMb = sizeMb
+    transpositionTable = TranspositionTable(sizeMb)
+
+@atexit.register
+def release_shared_table():
+    global sharedTableMemory
+    if sharedTableMemory is None:
+        return
+    transpositionTable.release()
+    sharedTableMemory.close()
+    sharedTableMemory.unlink()
+    sharedTableMemory = None
+
+class StopSignal:
+    """
+    Stop flag of a worker's search, set once the searching process has
+    stopped search `searchId` or a later one
+    """
+    def __init__(self, stoppedSearch, searchId:int) -> None:
+        self.stopped_search = stoppedSearch
+        self.search_id = searchId
+
+    def is_set(self) -> bool:
+        return self.stopped_search.value >= self.search_id
+
+def lazy_smp_worker(workerId:int, tasks, stoppedSearch, results):
+    """
+    One Lazy SMP search process, kept alive between searches. Odd workers
+    start one ply deeper and every helper gets its own history noise, so
+    they explore the tree in a different order and fill the shared table
+    for each other. A None task ends the process.
+    """
+    global transpositionTable, DEBUG, historyTable, nodes, searchStats
+
+    DEBUG = False
+    searchStats = None
+    memory = None
+    results.put(('ready', 0, workerId))
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            searchId, root, shmName, sizeMb, generation, limitsArgs, timeLeft, softTimeLeft = task
+
+            if memory is None or memory.name != shmName:
+                # the table moved (Hash was changed), attach to the new block
+                if memory is not None:
+                    transpositionTable.release()
+                    memory.close()
+                memory = shared_memory.SharedMemory(name=shmName)
+                transpositionTable = TranspositionTable(sizeMb, buffer=memory.buf)
+            transpositionTable.generation = generation
+            transpositionTable.probes = transpositionTable.hits = 0
+
+            board = ChessBoard(root.to_position())
+            nodes = 0
+            reset_move_ordering()
+            if workerId:
+                noise = random.Random(workerId)
+                historyTable = [[noise.randrange(64) for _key in range(4096)] for _color in (BLACK, WHITE)]
+
+            limits = SearchLimits(**limitsArgs)
+            limits.stop_event = StopSignal(stoppedSearch, searchId)
+            limits.start(root.turn)
+            # the budget is what the searching process had left when it handed the task over
+            t0 = limits.t0
+            limits.deadline = t0 + timeLeft if timeLeft is not None else None
+            limits.soft_deadline = t0 + softTimeLeft if softTimeLeft is not None else None
+
+            def report(move, value, depth):
+                results.put(('iteration', searchId, workerId, depth, move, value, nodes, time.monotonic() - t0))
+
+            iterative_deepening(board, limits, startDepth=1 + (workerId & 1), on_iteration=report)
+
+            results.put(('done', searchId, workerId, nodes, time.monotonic() - t0, transpositionTable.probes, transpositionTable.hits))
+    finally:
+        if memory is not None:
+            transpositionTable.release()
+            memory.close()
+
+def worker_context():
+    """
+    Start method of the Lazy SMP workers. They are never forked from the
+    searching process: the UCI front end searches on a thread while its main
+    thread blocks reading stdin, and forked children deadlock on the stdin
+    lock as they start.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['ChessyMoon'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+class WorkerPool:
+    """
+    Lazy SMP worker processes, started once and reused by every search.
+    Searches are numbered; a worker still busy with a stopped search takes
+    its next task once it is done, and is replaced if it is still at it
+    workerStopGrace seconds after the stop.
+    """
+    def __init__(self) -> None:
+        self.context = worker_context()
+        self.results = self.context.Queue()
+        self.stopped_search = self.context.Value('q', 0, lock=False)
+        self.workers = []   # (process, task queue)
+        self.late = {}      # workerId: when the search it has not finished was stopped
+        self.search_id = 0
+
+    def start_worker(self, workerId:int):
+        tasks = self.context.Queue()
+        process = self.context.Process(target=lazy_smp_worker, daemon=True,
+                                       args=(workerId, tasks, self.stopped_search, self.results))
+        process.start()
+        if workerId < len(self.workers):
+            self.workers[workerId] = (process, tasks)
+        else:
+            self.workers.append((process, tasks))
+
+    def grow(self, threads:int) -> list[int]:
+        started = list(range(len(self.workers), threads))
+        for workerId in started:
+            self.start_worker(workerId)
+        return started
+
+    def wait_ready(self, workerIds:list[int], timeout:float):
+        waiting = set(workerIds)
+        deadline = time.monotonic() + timeout
+        while waiting and time.monotonic() < deadline:
+            try:
+                message = self.results.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            if message[0] == 'ready':
+                waiting.discard(message[2])
+            else:
+                self.finished(message)
+
+    def finished(self, message:tuple):
+        # a late worker reporting a search it was cut off from has caught up
+        if message[0] == 'done':
+            self.late.pop(message[2], None)
+
+    def search(self, threads:int, task:tuple) -> int:
+        """
+        Hands `task` to the first `threads` workers, returns the search id
+        their messages carry
+        """
+        while True:
+            try:
+                self.finished(self.results.get_nowait())
+            except queue.Empty:
+                break
+
+        now = time.monotonic()
+        for workerId, (process, _tasks) in enumerate(self.workers):
+            if not process.is_alive() or now - self.late.get(workerId, now) >= workerStopGrace:
+                process.terminate()
+                process.join()
+                self.late.pop(workerId, None)
+                self.start_worker(workerId)
+        self.grow(threads)
+
+        self.search_id += 1
+        for workerId in range(threads):
+            self.workers[workerId][1].put((self.search_id,) + task)
+        return self.search_id
+
+    def stop(self, searchId:int, unfinished=()):
+        self.stopped_search.value = searchId
+        now = time.monotonic()
+        for workerId in unfinished:
+            self.late.setdefault(workerId, now)
+
+    def alive(self, workerId:int) -> bool:
+        return self.workers[workerId][0].is_alive()
+
+    def shutdown(self):
+        self.stopped_search.value = self.search_id
+        for process, tasks in self.workers:
+            if process.is_alive():
+                tasks.put(None)
+        for process, _tasks in self.workers:
+            process.join(workerStopGrace)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.workers = []
+
+def start_worker_pool(threads:int, timeout:float=0):
+    """
+    Starts the Lazy SMP workers and waits (up to `timeout` seconds) until
+    they can search, so that the first search does not spend part of its
+    time budget on it
+    """
+    global workerPool
+    if threads < 2:
+        return
+    if workerPool is None:
+        workerPool = WorkerPool()
+    workerPool.wait_ready(workerPool.grow(threads), timeout)
+
+@atexit.register
+def stop_worker_pool():
+    global workerPool
+    if workerPool is not None:
+        workerPool.shutdown()
+        workerPool = None
+
+def lazy_smp_search(game:ChessBoard, limits:SearchLimits, threads:int, t0:float):
+    """
+    Runs the same root on `threads` worker processes sharing the
+    transposition table, and plays the deepest completed iteration
+    """
+    # handing the search to the workers is part of the budget
+    limits.start(game.turn)
+
+    shmName = share_transposition_table()
+    limitsArgs = limits.arguments()
+    if limits.nodes:
+        limitsArgs['nodes'] = max(1, limits.nodes // threads)
+
+    start_worker_pool(threads)
+    pool = workerPool
+    results = pool.results
+
+    root = CompactPosition.from_position(game.position)
+    now = time.monotonic()
+    timeLeft = max(limits.deadline - now, 0) if limits.deadline else None
+    softTimeLeft = max(limits.soft_deadline - now, 0) if limits.soft_deadline else None
+    searchId = pool.search(threads, (root, shmName, hashSizeMb, transpositionTable.generation, limitsArgs, timeLeft, softTimeLeft))
+
+    best = None  # (depth, move, value)
+    stats = {}
+    seenNodes = {}
+    stoppedAt = None
+    while len(stats) < threads:
+        now = time.monotonic()
+        if stoppedAt is None and (limits.stopped or (limits.deadline and now >= limits.deadline)):
+            pool.stop(searchId)
+            stoppedAt = now
+        if stoppedAt is not None:
+            # past the deadline only a search with nothing to play keeps waiting
+            grace = workerStopGrace if best is None or not limits.deadline else 0
+            if now - stoppedAt >= grace:
+                # a wedged worker must not hold up the move, play what was reported
+                break
+        if not any(pool.alive(workerId) for workerId in range(threads) if workerId not in stats) and results.empty():
+            break
+        try:
+            message = results.get(timeout=0.01)
+        except queue.Empty:
+            continue
+        if message[1] != searchId:
+            pool.finished(message)
+            continue
+
+        if message[0] == 'iteration':
+            _kind, _searchId, workerId, depth, move, value, workerNodes, elapsed = message
+            seenNodes[workerId] = workerNodes
+            if best is None or depth > best[0]:
+                best = (depth, move, value)
+        else:
+            _kind, _searchId, workerId, workerNodes, elapsed, probes, hits = message
+            stats[workerId] = {
+                'nodes': workerNodes,
+                'nps': workerNodes / max(elapsed, 0.001),
+                'tt_probes': probes,
+                'tt_hit_rate': hits / probes if probes else 0,
+            }
+            # the first worker to finish has reached the depth limit or a forced result
+            if stoppedAt is None:
+                pool.stop(searchId)
+                stoppedAt = now
+
+    # workers cut off here finish on their own, the next search checks on them
+    pool.stop(searchId, [workerId for workerId in range(threads) if workerId not in stats])
+
+    duration = max(time.monotonic() - t0, 0.001)
+
+    bestMove, bestMoveValue, completedDepth = None, None, 0
+    if best:
+        completedDepth, bestMove, bestMoveValue = best
+
+    # workers cut off before reporting are counted up to their last iteration
+    seenNodes.update((workerId, worker['nodes']) for workerId, worker in stats.items())
+    totalNodes = sum(seenNodes.values())
+    totalProbes = sum(worker['tt_probes'] for worker in stats.values())
+
+    return build_result(game, bestMove, bestMoveValue, {
+        'nodes': totalNodes,
+        'duration': duration,
+        'depth': completedDepth,
+        'threads': threads,
+        'workers': [stats[workerId] for workerId in sorted(stats)],
+        'tt_hit_rate': sum(worker['tt_hit_rate'] * worker['tt_probes'] for worker in stats.values()) / totalProbes if totalProbes else 0,
+    })
 
 
-transpositionCache = TranspositionCache()
-moveDiscoveryCache = MoveDiscoveryCache()
+def perft(board:ChessBoard, depth:int) -> int:
+    """
+    Number of leaf nodes `depth` plies below the board, counted with the
+    search's own move generator. A position whose king was captured is
+    over and has no moves.
+    """
+    if depth <= 0:
+        return 1
+    position = board.position
+    if position.w_king is None or position.b_king is None:
+        return 0
+
+    possible_moves = board.get_move_list()
+    if depth == 1:
+        return len(possible_moves)
+
+    count = 0
+    for move in possible_moves:
+        board.make_packed_move(move)
+        count += perft(board, depth - 1)
+        board.unmake_move()
+    return count
+
+def perft_fen(fen:str, depth:int) -> int:
+    return perft(ChessBoard(Position(fen)), depth)
+
+def perft_compact(position:CompactPosition, depth:int) -> int:
+    return perft(ChessBoard(position.to_position()), depth)
+
+def perft_divide(board:ChessBoard, depth:int, workers:int=1) -> list[tuple[str, int]]:
+    """
+    perft() of every root move, as ("e2e4", count) pairs. With `workers` > 1
+    the root moves are counted in a process pool.
+    """
+    position = board.position
+    if depth <= 0 or position.w_king is None or position.b_king is None:
+        return []
+
+    if workers <= 1:
+        divide = []
+        for move in board.get_move_list():
+            board.make_packed_move(move)
+            divide.append((uci_notation(move), perft(board, depth - 1)))
+            board.unmake_move()
+        return divide
+
+    moves = []
+    children = []
+    for move in board.get_move_list():
+        moves.append(uci_notation(move))
+        board.make_packed_move(move)
+        children.append(CompactPosition.from_position(position))
+        board.unmake_move()
+
+    with multiprocessing.Pool(workers) as pool:
+        counts = pool.starmap(perft_compact, [(child, depth - 1) for child in children])
+    return list(zip(moves, counts))
+
+openingBook = None
+transpositionTable = TranspositionTable(hashSizeMb)
+sharedTableMemory = None
+workerPool = None
+searchLimits = SearchLimits()
+searchStats = None
+reset_move_ordering()
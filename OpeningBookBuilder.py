@@ -0,0 +1,299 @@
+# Builds a compiled opening book (see ChessyMoon.CompiledOpeningBook) from
+# game collections: PGN files, or plain text files with one game per line
+# written as UCI moves ("e2e4 e7e5 g1f3 ... 1-0").
+#
+# Games are replayed on the engine's own Position, so a game is only followed
+# up to the first move the engine cannot play the same way (castling, en
+# passant, under-promotion); the positions before it are still counted.
+
+import re
+from multiprocessing import Pool
+
+from ChessyMoon import Position, Square, write_compiled_book, WHITE, BLACK, DRAW
+from BitboardHelper import KNIGHT_ATTACKS, squares_of
+
+RESULTS = {'1-0': WHITE, '0-1': BLACK, '1/2-1/2': DRAW, '*': None}
+
+SAN_MOVE = re.compile(r'^([NBRQKÑ])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBNÑ]))?[+#!?]*$')
+UCI_MOVE = re.compile(r'^([a-h][1-8])([a-h][1-8])([qrbnñ]?)$')
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+
+# a game's counters, from the point of view of the side that played the move
+GAMES, WINS, DRAWS, LOSSES = range(4)
+
+
+class GameReader:
+    """
+    Streams (tokens, result) pairs out of a game file without loading it.
+    Comments, variations, NAGs and move numbers are dropped; a game ends on
+    its result token, on the next tag section, or (for UCI lines) at the
+    end of its line.
+    """
+    def __init__(self, path:str) -> None:
+        self.path = path
+
+    def __iter__(self):
+        tokens = []
+        depth = 0   # inside a {comment} or a (variation)
+        uciLine = False
+
+        with open(self.path, encoding='utf-8', errors='replace') as file:
+            for line in file:
+                line = line.strip()
+                if depth == 0 and line.startswith('['):
+                    if tokens:
+                        yield (tokens, None)
+                        tokens = []
+                    continue
+                if line.startswith('%'):
+                    continue
+
+                line = line.split(';', 1)[0] if depth == 0 else line
+                for word in line.replace('{', ' { ').replace('}', ' } ').replace('(', ' ( ').replace(')', ' ) ').split():
+                    if word in ('{', '('):
+                        depth += 1
+                        continue
+                    if word in ('}', ')'):
+                        depth = max(depth - 1, 0)
+                        continue
+                    if depth or word.startswith('$'):
+                        continue
+                    if word in RESULTS:
+                        yield (tokens, RESULTS[word])
+                        tokens = []
+                        uciLine = False
+                        continue
+                    word = MOVE_NUMBER.sub('', word)
+                    if not word:
+                        continue
+                    if not tokens:
+                        uciLine = bool(UCI_MOVE.match(word))
+                    tokens.append(word)
+
+                if uciLine and tokens:
+                    yield (tokens, None)
+                    tokens = []
+                    uciLine = False
+
+        if tokens:
+            yield (tokens, None)
+
+
+def own_king_attacked(position:Position, color:bool) -> bool:
+    king = position.w_king if color else position.b_king
+    if king is None:
+        return True
+    return position.is_attacked(king.idx, not color)
+
+def reaches(position:Position, src:int, dst:int) -> bool:
+    """
+    Whether the piece on `src` can go to `dst`: a generated move, a double
+    push over an empty square or a knight fusing with its own rook
+    """
+    if position.targets(src) >> dst & 1:
+        return True
+    matrix = position.matrix
+    piece = matrix[src]
+    if piece.piece == 'p':
+        start, jump = (6, 4) if piece.color else (1, 3)
+        return src % 8 == dst % 8 and (src // 8, dst // 8) == (start, jump) and not matrix[dst] and not matrix[(src + dst) // 2]
+    if piece.piece == 'n':
+        return bool(KNIGHT_ATTACKS[src] >> dst & 1) and bool(matrix[dst]) and matrix[dst].color == piece.color and matrix[dst].piece == 'r'
+    return False
+
+def resolve_uci(position:Position, token:str) -> tuple[int, int] | None:
+    match = UCI_MOVE.match(token)
+    if not match:
+        return None
+    src = Square(algebraic=match[1]).idx
+    dst = Square(algebraic=match[2]).idx
+    piece = position.matrix[src]
+    if not piece or piece.color != position.turn:
+        return None
+    if match[3] not in ('', 'q'):
+        return None
+
+    if not reaches(position, src, dst):
+        return None
+    return src, dst
+
+def resolve_san(position:Position, token:str) -> tuple[int, int] | None:
+    match = SAN_MOVE.match(token)
+    if not match:
+        return None
+    letter, fromCol, fromRow, target, promotion = match.groups()
+    color = position.turn
+    kind = letter.lower() if letter else 'p'
+    dst = Square(algebraic=target).idx
+    matrix = position.matrix
+
+    candidates = []
+    if kind == 'p':
+        if dst // 8 in (0, 7) and promotion not in (None, 'Q'):
+            return None
+        for src in squares_of(position.bitboards[color]['p']):
+            if reaches(position, src, dst):
+                candidates.append(src)
+    else:
+        fusion = kind == 'n' and promotion == 'Ñ'
+        for src in squares_of(position.bitboards[color][kind]):
+            if fusion:
+                if KNIGHT_ATTACKS[src] >> dst & 1 and matrix[dst] and matrix[dst].color == color and matrix[dst].piece == 'r':
+                    candidates.append(src)
+            elif position.targets(src) >> dst & 1:
+                candidates.append(src)
+
+    if fromCol:
+        candidates = [src for src in candidates if src % 8 == ord(fromCol) - 97]
+    if fromRow:
+        candidates = [src for src in candidates if src // 8 == 8 - int(fromRow)]
+
+    if len(candidates) > 1:
+        legal = []
+        for src in candidates:
+            undo = position.make_move(src, dst)
+            if not own_king_attacked(position, color):
+                legal.append(src)
+            position.unmake_move(undo)
+        candidates = legal
+
+    if len(candidates) != 1:
+        return None
+    return candidates[0], dst
+
+def count_games(games, maxPly:int) -> dict[int, list[int]]:
+    """
+    {hash << 12 | move: [games, wins, draws, losses]} for a batch of games
+    """
+    counts = {}
+    for tokens, result in games:
+        position = Position()
+        resolve = resolve_uci if UCI_MOVE.match(tokens[0]) else resolve_san
+
+        for token in tokens[:maxPly]:
+            move = resolve(position, token)
+            if move is None:
+                break
+            src, dst = move
+            color = position.turn
+            key = (position.hash << 12) | src | (dst << 6)
+
+            entry = counts.get(key)
+            if entry is None:
+                entry = counts[key] = [0, 0, 0, 0]
+            entry[GAMES] += 1
+            if result == DRAW:
+                entry[DRAWS] += 1
+            elif result == color:
+                entry[WINS] += 1
+            elif result is not None:
+                entry[LOSSES] += 1
+
+            position.make_move(src, dst)
+            if position.w_king is None or position.b_king is None:
+                break
+    return counts
+
+
+class BookBuilder:
+    """
+    Aggregates move statistics over any number of game files and writes them
+    as a weighted compiled book.
+
+    Memory is bounded by `maxEntries`: whenever the table grows past it, the
+    (position, move) pairs seen no more than `floor` times are dropped and the
+    floor is raised, so only lines that keep reappearing survive. A frequent
+    line loses at most `floor` games from its counts.
+    """
+    def __init__(self, maxPly=16, minGames=3, maxEntries=2_000_000, workers=1, batchSize=500) -> None:
+        self.maxPly = maxPly
+        self.minGames = minGames
+        self.maxEntries = maxEntries
+        self.workers = workers
+        self.batchSize = batchSize
+        self.counts: dict[int, list[int]] = {}
+        self.floor = 0
+        self.games = 0
+
+    def batches(self, paths):
+        for path in paths:
+            batch = []
+            for game in GameReader(path):
+                if game[0]:
+                    batch.append(game)
+                if len(batch) >= self.batchSize:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def merge(self, counts):
+        total = self.counts
+        for key, stats in counts.items():
+            entry = total.get(key)
+            if entry is None:
+                total[key] = stats
+            else:
+                entry[0] += stats[0]
+                entry[1] += stats[1]
+                entry[2] += stats[2]
+                entry[3] += stats[3]
+        if len(total) > self.maxEntries:
+            self.floor += 1
+            floor = self.floor
+            self.counts = {key: stats for key, stats in total.items() if stats[GAMES] > floor}
+
+    def add(self, paths:list[str], progress=None):
+        if self.workers <= 1:
+            for batch in self.batches(paths):
+                self.merge(count_games(batch, self.maxPly))
+                self.games += len(batch)
+                if progress:
+                    progress(self)
+            return self
+
+        # at most two batches per worker in flight, the files are never read ahead further
+        with Pool(self.workers) as pool:
+            pending = []
+            for batch in self.batches(paths):
+                pending.append((len(batch), pool.apply_async(count_games, (batch, self.maxPly))))
+                while len(pending) >= 2 * self.workers:
+                    self.collect(pending.pop(0), progress)
+            while pending:
+                self.collect(pending.pop(0), progress)
+        return self
+
+    def collect(self, job, progress):
+        size, result = job
+        self.merge(result.get())
+        self.games += size
+        if progress:
+            progress(self)
+
+    def weights(self) -> dict[int, dict[int, int]]:
+        """
+        {hash: {move: weight}} for the moves played at least `minGames`
+        times, weighted 2 per win and 1 per draw of the side that played them
+        """
+        entries = {}
+        for key, (games, wins, draws, losses) in self.counts.items():
+            if games < self.minGames:
+                continue
+            entries.setdefault(key >> 12, {})[key & 0xFFF] = 2 * wins + draws
+
+        for moves in entries.values():
+            best = max(moves.values())
+            scale = 0xFFFF / best if best > 0xFFFF else 1
+            for move, weight in moves.items():
+                moves[move] = max(1, int(weight * scale))
+        return entries
+
+    def write(self, dst:str) -> dict:
+        entries = self.weights()
+        write_compiled_book(entries, dst)
+        return {
+            'games': self.games,
+            'positions': len(entries),
+            'moves': sum(len(moves) for moves in entries.values()),
+            'floor': self.floor,
+        }
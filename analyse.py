@@ -0,0 +1,178 @@
+# Batch analysis: `python main.py analyse --input positions.epd --workers N`.
+#
+# Positions are read lazily (one FEN or EPD record per line), searched in a
+# process pool where each worker keeps its own transposition table for its
+# whole life, and written as one JSON line per position as soon as it is done,
+# so records come out in completion order and carry their input index.
+
+import argparse
+import json
+import multiprocessing
+import queue
+import sys
+import time
+
+import ChessyMoon
+from ChessyMoon import ChessBoard, Position, SearchLimits, NoOpeningBook, getBestMove
+
+
+def read_positions(path:str, offset:int=0, skip=()):
+    """
+    Yields (index, fen, id) for every position line from `offset` on,
+    leaving out the indices in `skip`. Indices count position lines only.
+    """
+    index = -1
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            index += 1
+            if index < offset or index in skip:
+                continue
+
+            fields = line.split(';')[0].split()
+            fen = ' '.join(fields[:2]) + ' - - 0 1'
+            positionId = None
+            if ' id ' in f" {line}":
+                positionId = line.split(' id ', 1)[1].split(';')[0].strip().strip('"')
+            yield index, fen, positionId
+
+def finished_indices(path:str) -> set[int]:
+    done = set()
+    try:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    done.add(json.loads(line)['index'])
+                except (ValueError, KeyError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def init_worker(hashMb:float):
+    ChessyMoon.DEBUG = False
+    ChessyMoon.set_hash_size(hashMb)
+
+def analyse_position(index:int, fen:str, positionId:str|None, limitsArgs:dict) -> dict:
+    """
+    The search result of one position, or an error record if it could not be
+    analysed, so that one bad line does not stop (or block resuming) a batch
+    """
+    try:
+        board = ChessBoard(Position(fen), opening_book=NoOpeningBook())
+        bestMove, evaluation, debug = getBestMove(board, SearchLimits(**limitsArgs), threads=1)
+    except Exception as e:
+        return {'index': index, 'id': positionId, 'fen': fen, 'error': f"{type(e).__name__}: {e}"}
+    return {
+        'index': index,
+        'id': positionId,
+        'fen': fen,
+        'move': f"{bestMove.last_move[0]}{bestMove.last_move[1]}" if bestMove else None,
+        'score': evaluation,
+        'depth': debug.depth,
+        'nodes': debug.nodes,
+        'time': round(debug.duration, 4),
+    }
+
+
+class Progress:
+    def __init__(self, stream=sys.stderr, interval:float=1.0) -> None:
+        self.stream = stream
+        self.interval = interval
+        self.done = 0
+        self.nodes = 0
+        self.t0 = self.last = time.monotonic()
+
+    def update(self, record:dict, final=False):
+        if record:
+            self.done += 1
+            self.nodes += record.get('nodes', 0)
+        now = time.monotonic()
+        if final or now - self.last >= self.interval:
+            self.last = now
+            elapsed = max(now - self.t0, 0.001)
+            self.stream.write(f"\r{self.done} positions, {self.done / elapsed:.1f}/s, {self.nodes / elapsed:.0f} nodes/s")
+            if final:
+                self.stream.write("\n")
+            self.stream.flush()
+
+
+def run_analysis(positions, output, limitsArgs:dict, workers:int=1, hashMb:float=None, progress=None):
+    """
+    Analyses (index, fen, id) triples from `positions` and writes a JSON line
+    per position to `output`. At most two positions per worker are read
+    ahead of the results.
+    """
+    hashMb = hashMb or ChessyMoon.hashSizeMb
+
+    def write(record):
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+        if progress:
+            progress.update(record)
+
+    if workers <= 1:
+        init_worker(hashMb)
+        for index, fen, positionId in positions:
+            write(analyse_position(index, fen, positionId, limitsArgs))
+        return
+
+    results = queue.Queue()
+    inFlight = 0
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(hashMb,)) as pool:
+        for index, fen, positionId in positions:
+            pool.apply_async(analyse_position, (index, fen, positionId, limitsArgs),
+                             callback=results.put, error_callback=results.put)
+            inFlight += 1
+            while inFlight >= 2 * workers:
+                inFlight -= 1
+                collect(results.get(), write)
+        while inFlight:
+            inFlight -= 1
+            collect(results.get(), write)
+
+def collect(result, write):
+    if isinstance(result, BaseException):
+        raise result
+    write(result)
+
+
+def analyse_command(args):
+    parser = argparse.ArgumentParser(prog='main.py analyse')
+    parser.add_argument('--input', required=True, help='FEN or EPD file, one position per line')
+    parser.add_argument('--output', default=None, help='JSONL file to append to (default: stdout)')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--nodes', type=int, default=None)
+    parser.add_argument('--movetime', type=int, default=None, help='milliseconds per position')
+    parser.add_argument('--hash', type=float, default=ChessyMoon.hashSizeMb, help='transposition table MB per worker')
+    parser.add_argument('--offset', type=int, default=0, help='skip the first N positions')
+    parser.add_argument('--resume', action='store_true', help='skip the positions already in --output')
+    options = parser.parse_args(args)
+
+    limitsArgs = {'depth': options.depth, 'nodes': options.nodes, 'movetime': options.movetime}
+    if not any(limitsArgs.values()):
+        limitsArgs['depth'] = 4
+
+    skip = set()
+    if options.resume:
+        if not options.output:
+            parser.error('--resume needs --output')
+        skip = finished_indices(options.output)
+
+    positions = read_positions(options.input, options.offset, skip)
+    output = open(options.output, 'a', encoding='utf-8') if options.output else sys.stdout
+    progress = Progress()
+    try:
+        run_analysis(positions, output, limitsArgs, options.workers, options.hash, progress)
+    finally:
+        progress.update(None, final=True)
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    analyse_command(sys.argv[1:])
@@ -1,51 +1,132 @@
-from collections import namedtuple
-from dataclasses import dataclass
-import timeit
-
-@dataclass
-class SquareDataclass:
-    attribute1: int
-    attribute2: str
-    attribute3: bool
-
-SquareNamedTuple = namedtuple('SquareNamedTuple', ['attribute1', 'attribute2', 'attribute3'])
-
-class SquareClassWithInit:
-    def __init__(self, attribute1, attribute2, attribute3):
-        self.attribute1 = attribute1
-        self.attribute2 = attribute2
-        self.attribute3 = attribute3
-
-class SquareClassWithoutInit:
-    pass
-
-def time_creation():
-    setup_code = '''
-from __main__ import SquareDataclass, SquareNamedTuple, SquareClassWithInit, SquareClassWithoutInit
-'''
-    dataclass_code = '''
-a = SquareDataclass(1, 'A', True)
-'''
-    namedtuple_code = '''
-a = SquareNamedTuple(1, 'A', True)
-'''
-    class_with_init_code = '''
-a = SquareClassWithInit(1, 'A', True)
-'''
-    class_without_init_code = '''
-a = SquareClassWithoutInit()
-a.attribute1 = 1
-a.attribute2 = 'A'
-a.attribute3 = True
-'''
-    dataclass_time = timeit.timeit(dataclass_code, setup=setup_code, number=1000000)
-    namedtuple_time = timeit.timeit(namedtuple_code, setup=setup_code, number=1000000)
-    class_with_init_time = timeit.timeit(class_with_init_code, setup=setup_code, number=1000000)
-    class_without_init_time = timeit.timeit(class_without_init_code, setup=setup_code, number=1000000)
-
-    print("Dataclass creation time:", dataclass_time)
-    print("Namedtuple creation time:", namedtuple_time)
-    print("Class with __init__ creation time:", class_with_init_time)
-    print("Class without __init__ creation time:", class_without_init_time)
-
-time_creation()
+# Engine benchmark: searches a fixed set of positions with fixed limits and
+# records nodes, speed, time to each depth and the move played. The signature
+# only depends on what was searched, so it changes with the search and not
+# with the machine; the speed is compared against a stored baseline.
+#
+#   python main.py bench [--depth N] [--nodes N] [--out bench.json] [--stats]
+#                        [--baseline baseline.json] [--threshold 0.1]
+
+import argparse
+import json
+import platform
+import sys
+import time
+import zlib
+
+import ChessyMoon
+from ChessyMoon import ChessBoard, Position, SearchLimits, NoOpeningBook, getBestMove
+
+BENCH_POSITIONS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1",
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w - - 0 1",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1",
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R b - - 0 1",
+    "r2q1rk1/ppp2ppp/2npbn2/2b1p3/2B1P3/2NPBN2/PPP2PPP/R2Q1RK1 w - - 0 1",
+    "ñ3k3/8/8/3p4/8/8/8/Ñ3K2R w - - 0 1",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "n3k3/1P6/8/8/8/8/6p1/4K2N w - - 0 1",
+]
+
+DEFAULT_DEPTH = 4
+
+
+def bench_position(fen:str, depth:int=None, nodes:int=None) -> dict:
+    ChessyMoon.transpositionTable.clear()
+    board = ChessBoard(Position(fen), opening_book=NoOpeningBook())
+
+    t0 = time.monotonic()
+    timeToDepth = []
+
+    def on_iteration(move, value, completed):
+        timeToDepth.append(round(time.monotonic() - t0, 4))
+
+    bestMove, evaluation, debug = getBestMove(board, SearchLimits(depth=depth, nodes=nodes), threads=1, on_iteration=on_iteration)
+    duration = time.monotonic() - t0
+
+    return {
+        'fen': fen,
+        'move': f"{bestMove.last_move[0]}{bestMove.last_move[1]}" if bestMove else None,
+        'eval': evaluation,
+        'depth': debug.depth,
+        'nodes': debug.nodes,
+        'time': round(duration, 4),
+        'nps': round(debug.nodes / duration) if duration else 0,
+        'time_to_depth': timeToDepth,
+        'stats': debug.stats.as_dict() if getattr(debug, 'stats', None) else None,
+    }
+
+def run_bench(depth:int=None, nodes:int=None, positions=BENCH_POSITIONS, progress=None) -> dict:
+    if depth is None and nodes is None:
+        depth = DEFAULT_DEPTH
+
+    debug = ChessyMoon.DEBUG
+    ChessyMoon.DEBUG = False
+    try:
+        results = []
+        for fen in positions:
+            results.append(bench_position(fen, depth, nodes))
+            if progress:
+                progress(results[-1])
+    finally:
+        ChessyMoon.DEBUG = debug
+
+    totalNodes = sum(result['nodes'] for result in results)
+    totalTime = sum(result['time'] for result in results)
+    signature = zlib.crc32(''.join(f"{result['fen']}|{result['move']}|{result['nodes']}\n" for result in results).encode())
+
+    return {
+        'limits': {'depth': depth, 'nodes': nodes},
+        'python': platform.python_version(),
+        'nodes': totalNodes,
+        'time': round(totalTime, 4),
+        'nps': round(totalNodes / totalTime) if totalTime else 0,
+        'signature': f"{signature:08x}",
+        'positions': results,
+    }
+
+def compare(report:dict, baseline:dict, threshold:float) -> list[str]:
+    """
+    Problems found against `baseline`: a different signature, or a speed
+    more than `threshold` (a fraction) below the baseline's
+    """
+    problems = []
+    if report['limits'] != baseline['limits']:
+        problems.append(f"limits differ from the baseline ({baseline['limits']}), speeds are not comparable")
+        return problems
+    if report['signature'] != baseline['signature']:
+        problems.append(f"signature {report['signature']} differs from the baseline's {baseline['signature']}: the search changed")
+    if report['nps'] < baseline['nps'] * (1 - threshold):
+        problems.append(f"{report['nps']} nodes/sec is {1 - report['nps'] / baseline['nps']:.1%} below the baseline's {baseline['nps']}")
+    return problems
+
+def bench_command(args) -> int:
+    parser = argparse.ArgumentParser(prog='main.py bench')
+    parser.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--nodes', type=int, default=None)
+    parser.add_argument('--out', default=None, help='write the report as JSON')
+    parser.add_argument('--baseline', default=None, help='report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown, as a fraction')
+    parser.add_argument('--stats', action='store_true', help='collect SearchStats for each position (slower)')
+    options = parser.parse_args(args)
+    ChessyMoon.collectSearchStats = options.stats
+
+    def progress(result):
+        print(f"{result['fen']:<70} {str(result['move']):<6} depth {result['depth']:>2} {result['nodes']:>9} nodes {result['nps']:>7} nps")
+
+    report = run_bench(options.depth, options.nodes, progress=progress)
+    print(f"\nNodes: {report['nodes']}\nTime: {report['time']:.3f}s\nNodes/sec: {report['nps']}\nSignature: {report['signature']}")
+
+    if options.out:
+        with open(options.out, 'w') as file:
+            json.dump(report, file, indent=4)
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            problems = compare(report, json.load(file), options.threshold)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(bench_command(sys.argv[1:]))
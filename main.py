@@ -1,6 +1,10 @@
+import argparse
+import json
+import os
 import sys
+import time
 import traceback
-from ChessyMoon import Position, ChessBoard, getBestMove, Square
+from ChessyMoon import Position, ChessBoard, getBestMove, Square, compile_opening_book, perft, perft_divide
 
 import cProfile
 
@@ -14,11 +18,112 @@ def main():
     elif 'perf' in sys.argv:
         debug = True if "debug" in sys.argv else False
         return test_fen_eval(debug)
+    elif 'book' in sys.argv:
+        return book_command(sys.argv[sys.argv.index('book') + 1:])
+    elif 'perft' in sys.argv:
+        return perft_command(sys.argv[sys.argv.index('perft') + 1:])
+    elif 'uci' in sys.argv:
+        from uci import uci_command
+        return uci_command(sys.argv[sys.argv.index('uci') + 1:])
+    elif 'analyse' in sys.argv:
+        from analyse import analyse_command
+        return analyse_command(sys.argv[sys.argv.index('analyse') + 1:])
+    elif 'match' in sys.argv:
+        from match import match_command
+        return match_command(sys.argv[sys.argv.index('match') + 1:])
+    elif 'bench' in sys.argv:
+        from bench import bench_command
+        exit(bench_command(sys.argv[sys.argv.index('bench') + 1:]))
     else:
         print('No arguments supplied')
     exit()
     
 
+def book_command(args):
+    if args and args[0] == 'build':
+        return build_book(args[1:])
+    if args and args[0] == 'compile':
+        src = args[1] if len(args) > 1 else "./opening_book.json"
+        dst = args[2] if len(args) > 2 else os.path.splitext(src)[0] + '.bin'
+        compile_opening_book(src, dst)
+        print(f"Compiled {src} into {dst}")
+    else:
+        print('Usage: main.py book compile [src.json] [dst.bin]')
+        print('       main.py book build games.pgn [...] [--out book.bin] [--max-ply N] [--min-games N] [--workers N]')
+
+
+def build_book(args):
+    from OpeningBookBuilder import BookBuilder
+
+    parser = argparse.ArgumentParser(prog='main.py book build')
+    parser.add_argument('games', nargs='+', help='PGN files or files of UCI move lines')
+    parser.add_argument('--out', default='./games_book.bin')
+    parser.add_argument('--max-ply', type=int, default=16)
+    parser.add_argument('--min-games', type=int, default=3)
+    parser.add_argument('--max-entries', type=int, default=2_000_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    options = parser.parse_args(args)
+
+    builder = BookBuilder(options.max_ply, options.min_games, options.max_entries, options.workers)
+    t0 = time.time()
+
+    def progress(builder):
+        print(f"\r{builder.games} games, {len(builder.counts)} entries, {time.time() - t0:.1f}s", end='', flush=True)
+
+    builder.add(options.games, progress)
+    summary = builder.write(options.out)
+    print(f"\nWrote {summary['moves']} moves in {summary['positions']} positions from {summary['games']} games to {options.out}")
+
+
+def perft_command(args):
+    parser = argparse.ArgumentParser(prog='main.py perft')
+    parser.add_argument('fen', help="a FEN, or 'suite' to check the reference positions")
+    parser.add_argument('depth', type=int, nargs='?', default=None)
+    parser.add_argument('divide', nargs='?', choices=['divide'])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--suite', default='./perft_suite.json')
+    options = parser.parse_args(args)
+
+    if options.fen == 'suite':
+        return perft_suite(options.suite, options.depth)
+    if options.depth is None:
+        parser.error('depth is required')
+
+    board = ChessBoard(Position(options.fen))
+    t0 = time.time()
+    if options.divide or options.workers > 1:
+        divide = perft_divide(board, options.depth, options.workers)
+        if options.divide:
+            for move, count in divide:
+                print(f"{move}: {count}")
+        nodes = sum(count for _move, count in divide)
+    else:
+        nodes = perft(board, options.depth)
+    duration = time.time() - t0
+
+    print(f"\nNodes: {nodes}")
+    print(f"Time: {duration:.3f}s ({nodes / max(duration, 1e-9):.0f} nodes/sec)")
+
+
+def perft_suite(src, maxDepth=None):
+    with open(src) as file:
+        suite = json.load(file)
+
+    failures = 0
+    for case in suite['positions']:
+        board = ChessBoard(Position(case['fen']))
+        for depth, expected in enumerate(case['nodes'][:maxDepth], 1):
+            t0 = time.time()
+            nodes = perft(board, depth)
+            duration = time.time() - t0
+            status = 'ok' if nodes == expected else f'FAIL (expected {expected})'
+            failures += nodes != expected
+            print(f"{case['name']:<14} depth {depth}: {nodes:>9} {nodes / max(duration, 1e-9):>9.0f} nodes/sec  {status}")
+
+    print(f"\n{failures} failure(s)")
+    return failures
+
+
 def test_fen_eval(debug=False):
     global board
 
@@ -73,7 +178,7 @@ def play_ai_vs_human(fen=None):
             squareFrom = Square(algebraic=move[:2])
             squareTo = Square(algebraic=move[2:])
             board.move(squareFrom, squareTo)
-            fen = board.position.fen
+            fen = board.position.get_fen()
 
         print(board)
 
@@ -0,0 +1,297 @@
+# Engine-vs-engine matches: `python main.py match --engine2 deltaMargin=150 ...`.
+#
+# Both engines are this engine with different module settings (any numeric
+# global of ChessyMoon, e.g. hashSizeMb, deltaMargin, maxQuiescenceNodes).
+# Every opening from the book is played twice with colours swapped, games run
+# in a process pool, and the match stops early once the SPRT decides.
+
+import argparse
+import math
+import multiprocessing
+import queue
+import random
+import sys
+
+import ChessyMoon
+from ChessyMoon import ChessBoard, Position, Square, SearchLimits, NoOpeningBook, TranspositionTable, getBestMove
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1"
+
+
+def parse_config(text:str) -> dict:
+    """
+    "name=value,name=value" into {name: value}, names being numeric ChessyMoon settings
+    """
+    config = {}
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        name, _, value = item.partition('=')
+        current = getattr(ChessyMoon, name, None)
+        if isinstance(current, bool) or not isinstance(current, (int, float)):
+            raise Exception(f"{name} is not a numeric setting of ChessyMoon")
+        config[name] = type(current)(float(value)) if isinstance(current, int) else float(value)
+    return config
+
+def book_opening(plies:int, seed:int) -> list[tuple[int, int]]:
+    """
+    A random walk of up to `plies` book moves, weighted as in get_theory_move
+    """
+    random.seed(seed)
+    board = ChessBoard(Position(START_FEN))
+    moves = []
+    for _ply in range(plies):
+        child = board.get_theory_move()
+        if child is None:
+            break
+        squareFrom, squareTo = child.last_move
+        moves.append((squareFrom.idx, squareTo.idx))
+        board = child
+    return moves
+
+
+class Adjudication:
+    def __init__(self, maxPlies=300, resignScore=1500, resignPlies=6, drawScore=10, drawPlies=20, drawAfter=80) -> None:
+        self.maxPlies = maxPlies
+        self.resignScore = resignScore
+        self.resignPlies = resignPlies
+        self.drawScore = drawScore
+        self.drawPlies = drawPlies
+        self.drawAfter = drawAfter
+
+
+def play_game(opening, configs, limitsArgs:dict, adjudication:Adjudication) -> tuple[float, str, int]:
+    """
+    Plays one game, configs being indexed by colour. Returns white's score
+    (1, 0.5 or 0), the reason and the number of plies.
+    """
+    ChessyMoon.DEBUG = False
+    defaults = {name: getattr(ChessyMoon, name) for config in configs for name in config}
+    tables = [TranspositionTable(configs[color].get('hashSizeMb', ChessyMoon.hashSizeMb)) for color in (0, 1)]
+    sharedTable = ChessyMoon.transpositionTable
+
+    board = ChessBoard(Position(START_FEN), opening_book=NoOpeningBook())
+    for src, dst in opening:
+        board.move(Square(idx=src), Square(idx=dst))
+
+    seen = {}
+    winning = losing = drawish = 0   # consecutive plies beyond the adjudication scores
+    ply = len(opening)
+    try:
+        while True:
+            position = board.position
+            if position.w_king is None:
+                return 0, 'king captured', ply
+            if position.b_king is None:
+                return 1, 'king captured', ply
+            seen[position.hash] = seen.get(position.hash, 0) + 1
+            if seen[position.hash] >= 3:
+                return 0.5, 'repetition', ply
+            if ply >= adjudication.maxPlies:
+                return 0.5, 'move limit', ply
+
+            color = board.turn
+            for name, value in defaults.items():
+                setattr(ChessyMoon, name, configs[color].get(name, value))
+            ChessyMoon.transpositionTable = tables[color]
+
+            child, score, _debug = getBestMove(board, SearchLimits(**limitsArgs), threads=1)
+            if child is None:
+                return 0.5, 'no moves', ply
+            board = child
+            board.opening_book = NoOpeningBook()
+            ply += 1
+
+            if score is None:
+                continue
+            winning = winning + 1 if score >= adjudication.resignScore else 0
+            losing = losing + 1 if score <= -adjudication.resignScore else 0
+            drawish = drawish + 1 if ply >= adjudication.drawAfter and abs(score) <= adjudication.drawScore else 0
+            if winning >= adjudication.resignPlies:
+                return 1, 'adjudicated', ply
+            if losing >= adjudication.resignPlies:
+                return 0, 'adjudicated', ply
+            if drawish >= adjudication.drawPlies:
+                return 0.5, 'adjudicated draw', ply
+    finally:
+        for name, value in defaults.items():
+            setattr(ChessyMoon, name, value)
+        ChessyMoon.transpositionTable = sharedTable
+
+def play_pair_game(gameId:int, opening, configs, engine1White:bool, limitsArgs:dict, adjudication:Adjudication):
+    whiteScore, reason, plies = play_game(opening, configs, limitsArgs, adjudication)
+    return gameId, whiteScore if engine1White else 1 - whiteScore, reason, plies
+
+
+class MatchStats:
+    """
+    Win/draw/loss record of engine 1, with its logistic Elo estimate and the
+    generalized SPRT between elo0 and elo1 (normal approximation of the
+    per-game score)
+    """
+    def __init__(self, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05) -> None:
+        self.wins = self.draws = self.losses = 0
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+
+    def add(self, score:float):
+        if score == 1:
+            self.wins += 1
+        elif score == 0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def games(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    def score(self) -> float:
+        return (self.wins + 0.5 * self.draws) / self.games() if self.games() else 0.5
+
+    def variance(self) -> float:
+        games, score = self.games(), self.score()
+        if not games:
+            return 0
+        return (self.wins * (1 - score) ** 2 + self.draws * (0.5 - score) ** 2 + self.losses * score ** 2) / games
+
+    @staticmethod
+    def elo(score:float) -> float:
+        score = min(max(score, 1e-6), 1 - 1e-6)
+        return -400 * math.log10(1 / score - 1)
+
+    @staticmethod
+    def expected(elo:float) -> float:
+        return 1 / (1 + 10 ** (-elo / 400))
+
+    def elo_interval(self) -> tuple[float, float, float]:
+        """
+        Elo estimate with its 95% confidence bounds
+        """
+        games, score = self.games(), self.score()
+        margin = 1.96 * math.sqrt(self.variance() / games) if games else 0
+        return self.elo(score), self.elo(score - margin), self.elo(score + margin)
+
+    def llr(self) -> float:
+        if not self.games():
+            return 0.0
+        # half a game of each outcome keeps the variance positive while the results are one-sided
+        wins, draws, losses = self.wins + 0.5, self.draws + 0.5, self.losses + 0.5
+        games = wins + draws + losses
+        mean = (wins + 0.5 * draws) / games
+        variance = (wins * (1 - mean) ** 2 + draws * (0.5 - mean) ** 2 + losses * mean ** 2) / games
+        s0, s1 = self.expected(self.elo0), self.expected(self.elo1)
+        return self.games() * (s1 - s0) * (2 * self.score() - s0 - s1) / (2 * variance)
+
+    def decision(self) -> str | None:
+        llr = self.llr()
+        if llr >= self.upper:
+            return 'H1'
+        if llr <= self.lower:
+            return 'H0'
+        return None
+
+    def __str__(self) -> str:
+        elo, low, high = self.elo_interval()
+        return (f"Games {self.games()}: +{self.wins} ={self.draws} -{self.losses}, Elo {elo:+.1f} [{low:+.1f}, {high:+.1f}], "
+                f"LLR {self.llr():.2f} [{self.lower:.2f}, {self.upper:.2f}]")
+
+
+def run_match(configs, games:int, limitsArgs:dict, adjudication:Adjudication, stats:MatchStats, workers:int=1,
+              openingPlies:int=8, seed:int=1, report=None) -> MatchStats:
+    """
+    Plays up to `games` games (pairs of colour-swapped games on the same book
+    opening) between configs[0] (engine 1) and configs[1], stopping as soon
+    as the SPRT accepts either hypothesis
+    """
+    def tasks():
+        for gameId in range(games):
+            if gameId % 2 == 0:
+                opening = book_opening(openingPlies, seed + gameId // 2)
+            engine1White = gameId % 2 == 0
+            pair = (configs[1], configs[0]) if engine1White else (configs[0], configs[1])
+            yield gameId, opening, pair, engine1White, limitsArgs, adjudication
+
+    def record(result):
+        _gameId, score, reason, plies = result
+        stats.add(score)
+        if report:
+            report(stats, result)
+        return stats.decision()
+
+    if workers <= 1:
+        for task in tasks():
+            if record(play_pair_game(*task)):
+                break
+        return stats
+
+    results = queue.Queue()
+    inFlight = 0
+    pool = multiprocessing.Pool(workers)
+    try:
+        for task in tasks():
+            pool.apply_async(play_pair_game, task, callback=results.put, error_callback=results.put)
+            inFlight += 1
+            if inFlight >= 2 * workers:
+                inFlight -= 1
+                if finish(results.get(), record):
+                    return stats
+        while inFlight:
+            inFlight -= 1
+            if finish(results.get(), record):
+                return stats
+    finally:
+        pool.terminate()
+        pool.join()
+    return stats
+
+def finish(result, record):
+    if isinstance(result, BaseException):
+        raise result
+    return record(result)
+
+
+def match_command(args):
+    parser = argparse.ArgumentParser(prog='main.py match')
+    parser.add_argument('--engine1', default='', help='settings of engine 1, e.g. "hashSizeMb=32,deltaMargin=150"')
+    parser.add_argument('--engine2', default='', help='settings of engine 2 (the baseline)')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--movetime', type=int, default=None, help='milliseconds per move')
+    parser.add_argument('--depth', type=int, default=None)
+    parser.add_argument('--nodes', type=int, default=None)
+    parser.add_argument('--opening-plies', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-plies', type=int, default=300)
+    parser.add_argument('--resign-score', type=float, default=1500)
+    parser.add_argument('--elo0', type=float, default=0)
+    parser.add_argument('--elo1', type=float, default=5)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    options = parser.parse_args(args)
+
+    configs = (parse_config(options.engine1), parse_config(options.engine2))
+    limitsArgs = {'movetime': options.movetime, 'depth': options.depth, 'nodes': options.nodes}
+    if not any(limitsArgs.values()):
+        limitsArgs['movetime'] = 100
+
+    adjudication = Adjudication(maxPlies=options.max_plies, resignScore=options.resign_score)
+    stats = MatchStats(options.elo0, options.elo1, options.alpha, options.beta)
+
+    def report(stats, result):
+        gameId, score, reason, plies = result
+        print(f"game {gameId + 1}: {score} ({reason}, {plies} plies)  {stats}", flush=True)
+
+    run_match(configs, options.games, limitsArgs, adjudication, stats, options.workers, options.opening_plies, options.seed, report)
+
+    decision = stats.decision()
+    print(f"\n{stats}")
+    if decision == 'H1':
+        print(f"SPRT: engine 1 is stronger by at least {options.elo1} Elo (H1 accepted)")
+    elif decision == 'H0':
+        print(f"SPRT: engine 1 is not stronger by {options.elo1} Elo (H0 accepted)")
+    else:
+        print("SPRT: no decision")
+
+
+if __name__ == "__main__":
+    match_command(sys.argv[1:])
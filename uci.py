@@ -0,0 +1,247 @@
+# UCI front end: `python main.py uci`.
+#
+# Commands are read on the main thread, searches run on a worker thread and
+# are cancelled through SearchLimits.stop(), which the search polls every
+# SearchLimits.CHECK_INTERVAL nodes, so `stop` lands within milliseconds.
+
+import math
+import sys
+import threading
+import time
+
+import ChessyMoon
+from ChessyMoon import ChessBoard, Position, Square, SearchLimits, NoOpeningBook, getBestMove, principal_variation
+from ChessyMoon import pack_move, uci_notation
+
+ENGINE_NAME = "ChessyMoon"
+ENGINE_AUTHOR = "bastien8060"
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1"
+
+GO_ARGUMENTS = {'depth': int, 'nodes': int, 'movetime': int, 'wtime': int, 'btime': int,
+                'winc': int, 'binc': int, 'movestogo': int}
+
+MATE_SCORE = 32000
+
+
+class UciEngine:
+    def __init__(self, output=sys.stdout) -> None:
+        self.output = output
+        self.lock = threading.Lock()
+        self.board = ChessBoard(Position(START_FEN))
+        self.ownBook = True
+
+        self.thread = None
+        self.limits = None
+        self.released = threading.Event()   # set once the GUI may receive bestmove
+        self.pending = None                 # real limits of a ponder search, applied on ponderhit
+
+    def send(self, line:str):
+        with self.lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def run(self, input=sys.stdin):
+        ChessyMoon.DEBUG = False
+        for line in input:
+            if not self.handle(line.strip()):
+                break
+        self.stop()
+
+    def handle(self, line:str) -> bool:
+        """
+        Runs one command, returns False on quit
+        """
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {ChessyMoon.hashSizeMb} min 1 max 4096")
+            self.send(f"option name Threads type spin default {ChessyMoon.searchThreads} min 1 max 64")
+            self.send("option name OwnBook type check default true")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.stop()
+            self.setoption(args)
+        elif command == 'ucinewgame':
+            self.stop()
+            ChessyMoon.transpositionTable.clear()
+        elif command == 'position':
+            self.stop()
+            self.position(args)
+        elif command == 'go':
+            self.stop()
+            self.go(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'quit':
+            return False
+        elif command == 'd':
+            self.send(str(self.board))
+            self.send(self.board.position.get_fen())
+        return True
+
+    def setoption(self, args):
+        if 'name' not in args:
+            return
+        valueAt = args.index('value') if 'value' in args else len(args)
+        name = ' '.join(args[args.index('name') + 1:valueAt]).lower()
+        value = ' '.join(args[valueAt + 1:])
+
+        if name == 'hash':
+            ChessyMoon.set_hash_size(max(1, int(value)))
+        elif name == 'threads':
+            ChessyMoon.searchThreads = max(1, int(value))
+            ChessyMoon.start_worker_pool(ChessyMoon.searchThreads, timeout=10)
+        elif name == 'ownbook':
+            self.ownBook = value.lower() == 'true'
+
+    def position(self, args):
+        if not args:
+            return
+        if args[0] == 'startpos':
+            fen, rest = START_FEN, args[1:]
+        elif args[0] == 'fen':
+            end = args.index('moves') if 'moves' in args else len(args)
+            fen, rest = ' '.join(args[1:end]), args[end:]
+        else:
+            return
+
+        board = ChessBoard(Position(fen))
+        if rest and rest[0] == 'moves':
+            for move in rest[1:]:
+                try:
+                    board.move(Square(algebraic=move[:2]), Square(algebraic=move[2:4]))
+                except Exception as e:
+                    self.send(f"info string illegal move {move}: {e}")
+                    break
+        # the undo stack of the game is not needed by the search
+        board.undo_stack = []
+        self.board = board
+
+    def go(self, args):
+        options = {}
+        infinite = ponder = False
+        i = 0
+        while i < len(args):
+            word = args[i]
+            if word in GO_ARGUMENTS and i + 1 < len(args):
+                options[word] = GO_ARGUMENTS[word](args[i + 1])
+                i += 2
+                continue
+            infinite |= word == 'infinite'
+            ponder |= word == 'ponder'
+            i += 1
+
+        if ponder:
+            # search without limits until ponderhit hands over the clock
+            self.pending = options
+            limits = SearchLimits(infinite=True)
+        else:
+            self.pending = None
+            limits = SearchLimits(infinite=infinite, **options)
+
+        self.limits = limits
+        self.released.clear()
+        if not (infinite or ponder):
+            self.released.set()
+
+        board = self.board.__deepcopy__()
+        if not self.ownBook or infinite or ponder:
+            board.opening_book = NoOpeningBook()
+
+        self.thread = threading.Thread(target=self.search, args=(board, limits), daemon=True)
+        self.thread.start()
+
+    def search(self, board:ChessBoard, limits:SearchLimits):
+        t0 = time.monotonic()
+
+        def on_iteration(move, value, depth):
+            self.info(board, move, value, depth, ChessyMoon.nodes, time.monotonic() - t0)
+
+        bestMove, evaluation, debug = getBestMove(board, limits, on_iteration=on_iteration)
+
+        line = []
+        if bestMove is not None:
+            squareFrom, squareTo = bestMove.last_move
+            move = pack_move(board.position, squareFrom.idx, squareTo.idx)
+            # book moves (double pushes) may be beyond the generator, the PV walk would drop them
+            line = principal_variation(board, move) or [move]
+            if debug.depth == 0 or getattr(debug, 'threads', 1) > 1:
+                # book moves and Lazy SMP searches do not report iterations
+                value = evaluation if board.turn else -evaluation
+                self.info(board, move, value, debug.depth, debug.nodes, debug.duration)
+
+        # after `go infinite` or `go ponder`, bestmove waits for stop or ponderhit
+        self.released.wait()
+
+        if not line:
+            self.send("bestmove 0000")
+        elif len(line) > 1:
+            self.send(f"bestmove {uci_notation(line[0])} ponder {uci_notation(line[1])}")
+        else:
+            self.send(f"bestmove {uci_notation(line[0])}")
+
+    def info(self, board:ChessBoard, move:int, value, depth, nodes, elapsed):
+        if value is None:
+            return
+        if abs(value) == math.inf:
+            score = MATE_SCORE if value > 0 else -MATE_SCORE
+        else:
+            score = round(value)
+
+        line = principal_variation(board, move, max(depth, 1)) or [move]
+        pv = [uci_notation(move) for move in line]
+
+        elapsed = max(elapsed, 0.001)
+        seldepth = f" seldepth {ChessyMoon.searchStats.seldepth}" if ChessyMoon.searchStats else ""
+        self.send(f"info depth {depth}{seldepth} score cp {score} nodes {nodes} nps {round(nodes / elapsed)} "
+                  f"time {round(elapsed * 1000)} hashfull {self.hashfull()} pv {' '.join(pv)}")
+
+    def hashfull(self) -> int:
+        # per mille of a 1000-entry sample that holds results of this search
+        table = ChessyMoon.transpositionTable.table
+        generation = ChessyMoon.transpositionTable.generation
+        sample = min(1000, len(table) // 2)
+        used = sum(1 for i in range(sample) if table[2 * i + 1] and (table[2 * i + 1] >> 26) & 63 == generation)
+        return used * 1000 // sample if sample else 0
+
+    def ponderhit(self):
+        limits = self.limits
+        if limits is None or self.pending is None:
+            return
+        for key, value in self.pending.items():
+            setattr(limits, key, value)
+        self.pending = None
+        limits.infinite = False
+        limits.start(self.board.turn)
+        # the clock only starts now, the search keeps what it found so far
+        if self.thread is not None and not self.thread.is_alive():
+            limits.stop()
+        self.released.set()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.limits.stop()
+        self.released.set()
+        self.thread.join()
+        self.thread = None
+        self.pending = None
+
+
+def uci_command(args):
+    UciEngine().run()
+
+
+if __name__ == "__main__":
+    uci_command(sys.argv[1:])